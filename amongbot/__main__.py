@@ -1,8 +1,12 @@
+import asyncio
 import os
+import signal
 import sys
-import json
 
 from .client import Client
+from .storage import GuildStore
+from .shards import Coordinator, recommended_shard_count, run_shard_group
+from .metrics import metrics
 
 # load token from env, fall back to token.txt
 token = os.getenv("DISCORD_TOKEN")
@@ -16,16 +20,46 @@ if not token:
         sys.exit(1)
 
 
-try:
-    with open("data.json") as save_file:
-        save_data = json.load(save_file)
-        client = Client(save_data=save_data)
-except FileNotFoundError:
-    client = Client()
-except json.JSONDecodeError:
-    if os.stat("data.json").st_size == 0:
-        client = Client()
-    else:
-        raise
+store = GuildStore("data")
+store.migrate("data.json")  # older versions kept every guild in a single data.json
 
-client.run(token)
+control_port = os.getenv("AMONGBOT_CONTROL_PORT")
+control_socket = os.getenv("AMONGBOT_CONTROL_SOCKET")
+control_token = os.getenv("AMONGBOT_CONTROL_TOKEN")
+if (control_port or control_socket) and not control_token:
+    print("The control socket needs a token. Set AMONGBOT_CONTROL_TOKEN to a long random string, and give it to the programs that connect to it.")
+    sys.exit(1)
+
+metrics_port = os.getenv("AMONGBOT_METRICS_PORT")
+metrics.enabled = bool(os.getenv("AMONGBOT_METRICS") or metrics_port)
+
+options = dict(startup_concurrency=int(os.getenv("AMONGBOT_STARTUP_CONCURRENCY", 10)),
+               speculative_mimic=bool(os.getenv("AMONGBOT_SPECULATIVE_MIMIC")),
+               control_port=int(control_port) if control_port else None,
+               control_socket=control_socket,
+               control_token=control_token,
+               low_memory=bool(os.getenv("AMONGBOT_LOW_MEMORY")))
+
+processes = int(os.getenv("AMONGBOT_PROCESSES", 0))
+if processes:
+    # this process only coordinates, the shard processes it starts connect to Discord
+    shard_count = int(os.getenv("AMONGBOT_SHARDS", 0)) or asyncio.run(recommended_shard_count(token))
+    if shard_count < processes:
+        print(f"Only {shard_count} shards, running {processes} processes with a shard each instead.")
+        shard_count = processes
+    coordinator = Coordinator(run_shard_group, shard_count=shard_count, processes=processes,
+                              args=(token, {**options, "store_path": store.path, "metrics": metrics.enabled}))
+
+    async def coordinate():
+        loop = asyncio.get_running_loop()
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signal_number, coordinator.stop)
+            except NotImplementedError:  # Windows
+                pass
+        await coordinator.run(metrics_port=int(metrics_port) if metrics_port else None)
+
+    asyncio.run(coordinate())
+else:
+    client = Client(store=store, metrics_port=int(metrics_port) if metrics_port else None, **options)
+    client.run(token)
@@ -0,0 +1,91 @@
+import asyncio
+
+import discord
+
+from .roster import MemberState
+
+
+class Action:
+    """Something users can do to a session, both with a control panel button and with a command."""
+    __slots__ = ("emoji", "command", "description", "handler")
+
+    def __init__(self, emoji, command, description, handler):
+        self.emoji = emoji
+        self.command = command
+        self.description = description
+        self.handler = handler  # async (session, member who did it)
+
+
+ACTIONS = []  # in the order the buttons go on the control panel
+_by_emoji = {}
+_by_command = {}
+
+
+def action(emoji, command, description):
+    def register(handler):
+        registered = Action(emoji, command, description, handler)
+        ACTIONS.append(registered)
+        _by_emoji[emoji] = registered
+        _by_command[command] = registered
+        return handler
+    return register
+
+
+def by_emoji(emoji):
+    return _by_emoji.get(str(emoji).rstrip("\ufe0f"))
+
+
+def by_command(command):
+    return _by_command.get(command)
+
+
+@action('🔈', "among:toggle", "Toggles global mute.")
+async def toggle_muting(session, member):
+    await session.toggle_muting()
+
+
+@action('©', "among:mimic", "Starts mimicking you, or stops if you're already being mimicked. Several members can be mimicked.")
+async def toggle_mimic(session, member):
+    if member in session.mimics:
+        await session.remove_mimic(member)
+        await session.control_panel.update()
+    elif session.add_mimic(member):
+        await session.control_panel.update()
+
+
+@action('🔄', "among:reset", "Sets all dead members as alive and unmutes everyone.")
+async def reset_dead(session, member):
+    for tracked_member in session.roster:
+        if tracked_member.state == MemberState.DEAD:
+            session.roster.set_state(tracked_member, MemberState.ALIVE)
+    await session.set_muting(False)
+    await session.control_panel.update()
+
+
+@action('🔔', "among:cues", "Joins the voice channel to play a sound when muting and unmuting, or leaves it.")
+async def toggle_cues(session, member):
+    voice = session.presence.voice
+    if session.playing_cues:
+        await voice.disconnect()
+    elif not voice.cues:
+        session.presence.reply(session.text_channel, "Error! No cues loaded. Put `mute` and `unmute` sound files in the cues folder and restart the bot.")
+        return
+    elif voice.session:
+        session.presence.reply(session.text_channel, f"Error! Already playing cues in {voice.session.voice_channel.name}. Only one voice channel per server can have them.")
+        return
+    elif session.voice_channel:
+        session.presence.actor.spawn(_connect_cues(session))  # can take up to the connect timeout, the guild doesn't wait for it
+        return
+    await session.control_panel.update()
+
+
+async def _connect_cues(session):
+    try:
+        await session.presence.voice.connect(session)
+    except (discord.ClientException, discord.opus.OpusNotLoaded, asyncio.TimeoutError, RuntimeError) as error:  # RuntimeError: PyNaCl missing
+        await session.text_channel.send(f"Error! Couldn't join {session.voice_channel.name}: {error}")
+        return
+    await session.control_panel.update()
+
+
+PANEL_EMOJIS = tuple(action.emoji for action in ACTIONS)
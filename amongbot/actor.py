@@ -0,0 +1,86 @@
+import asyncio
+import collections
+import traceback
+
+from .metrics import metrics
+
+
+class GuildActor:
+    """Runs one guild's event handlers from a single task, one at a time and in the order the events arrived.
+
+    Events that arrive while the actor is busy wait in its mailbox and get handled together as the next batch. While a
+    batch is handled the presence holds back mute edits and control panel refreshes, so however many events a batch had,
+    it ends in one reconciled set of mute edits (the MuteDispatcher only keeps the latest state of each member) and one
+    panel refresh.
+    """
+
+    def __init__(self, presence, *, batching=True, max_batch=100):
+        self.presence = presence
+        self.batching = batching  # False handles and releases events one by one, for comparison
+        self.max_batch = max_batch
+        self._mailbox = collections.deque()  # (event name, handler, args)
+        self._task = None
+        self._spawned = set()
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+        self.events_handled = 0
+        self.batches = 0
+
+    @property
+    def busy(self):
+        return not self._idle.is_set() or bool(self._spawned)
+
+    def post(self, event, handler, *args):
+        self._mailbox.append((event, handler, args))
+        self._idle.clear()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        guild_id = self.presence.guild.id
+        while self._mailbox:
+            batch_size = min(len(self._mailbox) if self.batching else 1, self.max_batch)
+            self.presence.hold()
+            try:
+                for _ in range(batch_size):
+                    event, handler, args = self._mailbox.popleft()
+                    try:
+                        with metrics.timed("handler_seconds", event, guild_id):
+                            await handler(*args)
+                    except Exception:  # a broken handler shouldn't take the whole guild down with it
+                        traceback.print_exc()
+            finally:
+                self.presence.release()
+            self.events_handled += batch_size
+            self.batches += 1
+            metrics.count("batches", guild_id=guild_id)
+            metrics.count("batched_events", guild_id=guild_id, value=batch_size)
+        self._idle.set()
+
+    def spawn(self, coroutine):
+        """Run a coroutine next to the actor instead of in it, for REST calls nothing else has to wait for."""
+        task = asyncio.create_task(coroutine)
+        self._spawned.add(task)
+        task.add_done_callback(self._spawned_done)
+        return task
+
+    def _spawned_done(self, task):
+        self._spawned.discard(task)
+        if not task.cancelled() and task.exception():
+            traceback.print_exception(task.exception())
+
+    async def join(self):
+        """Wait until every posted event is handled, along with what the handlers spawned."""
+        while self.busy:
+            await self._idle.wait()
+            if self._spawned:
+                await asyncio.wait(list(self._spawned))
+
+    def close(self):
+        if self._task:
+            self._task.cancel()
+        for task in list(self._spawned):
+            task.cancel()
+        self._mailbox.clear()
+        self._idle.set()
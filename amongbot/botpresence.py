@@ -1,141 +1,329 @@
 import asyncio
-import json
 import discord
-import timeit
-
-from .errors import SameValueError
-from .constants import SOURCE_CODE_URL
-
-
-class TrackedMember:
-    def __init__(self, member, presence, *, dead=False, mute=False, ignore=False):
-        self.member = member
-        self.presence = presence
-        self.state = "alive"
-        self._mute = mute
-        self.mute_lock = asyncio.Lock()
-
-    @property
-    def mute(self):
-        return self._mute
-
-    async def set_mute(self, mute_state):
-        async with self.mute_lock:
-            if self.state != "ignored" and self.is_in_vc:
-                if self.state == "dead":
-                    self._mute = True
-                else:
-                    self._mute = mute_state
-                if self.member.voice.mute != self._mute:
-                    await self.member.edit(mute=self._mute)
-
-    # TODO: i think this is dumb, should probably remove it or make it a function()()()()
-    @property
-    def is_in_vc(self):
-        if self.member.voice and self.member.voice.channel == self.presence.voice_channel:
-            return True
-        else:
-            return False
+import time
+
+from .errors import SameValueError, ChannelTakenError
+from .mutedispatcher import MuteDispatcher
+from .actor import GuildActor
+from .gesture import GestureRecognizer
+from .cues import GuildVoice
+from .roster import Roster, TrackedMember, MemberState
+from .exclusion import ExclusionCache
+from .constants import SOURCE_CODE_URL, MESSAGE_LIMIT
+from .actions import ACTIONS, PANEL_EMOJIS
+from . import actions
+from .timing import timed
+from .metrics import metrics
 
 
 class ControlPanel:
-    def __init__(self, presence, message=None):
-        self.presence = presence
-        self.message = message
+    def __init__(self, session, message=None, *, update_delay=0.5):
+        self.session = session
+        self.message = message  # first page, the one with the reactions
+        self.extra_pages = []  # overflow messages for rosters that don't fit in one message
+
+        # update() only marks the panel dirty, edits are coalesced and sent by a single background task
+        self.update_delay = update_delay  # window in which update requests are merged into one edit
+        self._dirty = False
+        self._update_task = None
+        self._sending = asyncio.Lock()  # send_new() runs outside the guild's actor, one at a time
+        self._released = asyncio.Event()  # cleared while the guild's actor is handling a batch of events
+        self._released.set()
+        self._sent = {}  # message id -> last content sent to it, to skip identical edits
+        self._lines = {}  # member id -> (state the line was formatted from, formatted line)
+
+        self.updates_requested = 0
+        self.edits_coalesced = 0  # merged into an already pending update
+        self.edits_sent = 0
+        self.edits_suppressed = 0  # skipped because the content didn't change
+
+        # clicks are removed through the cached message by a background task, so actions don't wait for them
+        self.click_window = 1  # seconds in which repeated clicks of the same button by the same member count as one
+        self._removals = {}  # (emoji, member id) -> (emoji, member) clicks waiting to be removed, in click order
+        self._removal_task = None
+        self._last_clicks = {}  # (emoji, member id) -> time of the last click that was acted on
+
+        self.clicks_collapsed = 0
+        self.reactions_removed = 0
 
     @classmethod
-    async def from_id(cls, id, presence):
-        self = ControlPanel(presence)
-        self.message = await presence.text_channel.fetch_message(id)  # NOTE: handle exceptions externally
+    async def from_id(cls, id, session):
+        self = ControlPanel(session)
+        self.message = await session.text_channel.fetch_message(id)  # NOTE: handle exceptions externally
 
-        await self.reset_reactions()
+        await self.reconcile_reactions()
         await self.update()
 
         return self
 
     async def send_new(self):
-        if self.message:
-            await self.message.delete()
-
-        self.message = await self.presence.text_channel.send("Loading...")
-        await self.presence.save()
-        await self.reset_reactions()
-        await self.update()
+        async with self._sending:
+            await self.delete()
+
+            self.message = await self.session.text_channel.send("Loading...")
+            self.session.client.presences.reindex(self.session)
+            await self.session.save()
+            await self.reconcile_reactions()
+            await self.update()
+
+    async def delete(self):
+        for message in [self.message] + self.extra_pages:
+            if message:
+                try:
+                    await message.delete()
+                except discord.NotFound:
+                    pass
+        self.message = None
+        self.extra_pages = []
+        self._sent = {}
+        self._removals = {}
 
     async def reset_reactions(self):
         await self.message.clear_reactions()
-        await self.message.add_reaction('🔈')
-        await self.message.add_reaction('©')
-        await self.message.add_reaction('🔄')
+        for emoji in PANEL_EMOJIS:
+            await self.message.add_reaction(emoji)
+
+    async def reconcile_reactions(self):
+        """Make the panel's reactions match PANEL_EMOJIS, only touching the ones that are wrong."""
+        own = []
+        for reaction in self.message.reactions:
+            emoji = str(reaction.emoji).rstrip("\ufe0f")
+            if emoji not in PANEL_EMOJIS:
+                await reaction.clear()  # foreign emoji
+                continue
+            if reaction.count > (1 if reaction.me else 0):  # clicks we missed while offline, our button stays
+                async for user in reaction.users():
+                    if user.id != self.session.client.user.id:
+                        await self.message.remove_reaction(reaction.emoji, user)
+            if reaction.me:
+                own.append(emoji)
+
+        if own != list(PANEL_EMOJIS[:len(own)]):  # buttons out of order, adding the missing ones won't fix that
+            await self.reset_reactions()
+            return
+        for emoji in PANEL_EMOJIS[len(own):]:
+            await self.message.add_reaction(emoji)
+
+    def click(self, emoji, member):
+        """Queue the removal of a member's click on the panel.
+
+        Returns False if the click repeats one the same member made less than click_window seconds ago, so it shouldn't
+        be acted on again.
+        """
+        key = (str(emoji), member.id)
+        self._removals[key] = (emoji, member)
+        if self._removal_task is None or self._removal_task.done():
+            self._removal_task = asyncio.create_task(self._remove_clicks())
+
+        now = time.monotonic()
+        if now - self._last_clicks.get(key, -self.click_window) < self.click_window:
+            self.clicks_collapsed += 1
+            return False
+        self._last_clicks = {old: clicked for old, clicked in self._last_clicks.items() if now - clicked < self.click_window}
+        self._last_clicks[key] = now
+        return True
+
+    async def _remove_clicks(self):
+        while self._removals and self.message:
+            key = next(iter(self._removals))
+            emoji, member = self._removals.pop(key)
+            try:
+                metrics.count("api_calls", "reaction.remove", self.session.guild.id)
+                with metrics.timed("api_seconds", "reaction.remove", self.session.guild.id):
+                    await self.message.remove_reaction(emoji, member)  # no fetch, the cached message has everything needed
+                self.reactions_removed += 1
+            except discord.NotFound:  # panel deleted in the meantime
+                pass
+            except discord.HTTPException as error:
+                print(f"Couldn't remove reaction from control panel in {self.session.guild.name}: {error}")
+        self._removals = {}
+
+    def hold(self):
+        """Keep update() from editing the panel until release()."""
+        self._released.clear()
+
+    def release(self):
+        self._released.set()
 
     async def update(self):
+        self.updates_requested += 1
+        if self._dirty:
+            self.edits_coalesced += 1
+        self._dirty = True
+        if self._update_task is None or self._update_task.done():
+            self._update_task = asyncio.create_task(self._update_loop())
+
+    async def _update_loop(self):
+        # never more than one edit in flight: requests arriving during an edit just cause another round
+        while self._dirty:
+            await asyncio.sleep(self.update_delay)
+            await self._released.wait()
+            self._dirty = False
+            try:
+                await self._edit()
+            except discord.HTTPException as error:
+                print(f"Couldn't update control panel in {self.session.guild.name}: {error}")
+
+    async def _edit(self):
         if self.message is None:
             return
 
+        pages = self.render()
+
+        pages_changed = len(pages) != len(self.extra_pages) + 1
+        while len(self.extra_pages) + 1 < len(pages):
+            self.extra_pages.append(await self.session.text_channel.send("Loading..."))
+        while len(self.extra_pages) + 1 > len(pages):
+            await self.extra_pages.pop().delete()
+        if pages_changed:
+            await self.session.save()
+
+        edited = False
+        for message, text in zip([self.message] + self.extra_pages, pages):
+            if self._sent.get(message.id) == text:
+                continue
+            metrics.count("api_calls", "message.edit", self.session.guild.id)
+            with metrics.timed("api_seconds", "message.edit", self.session.guild.id):
+                await message.edit(content=text)
+            self._sent[message.id] = text
+            self.edits_sent += 1
+            edited = True
+        if not edited:
+            self.edits_suppressed += 1
+
+    def render(self):
+        """Render the panel, split into pages that each fit in a message.
+
+        Member lines are cached and only re-formatted when something shown in them changed.
+        """
+        roster = self.session.roster
+        name_width = max((len(tracked_member.display_name) for tracked_member in roster), default=0)
+
+        lines = []
+        cache = {}
+        for tracked_member in roster:
+            key = (tracked_member.slot if tracked_member.in_vc else None, tracked_member.display_name, tracked_member.state, name_width)
+            cached = self._lines.get(tracked_member.id)
+            if cached is None or cached[0] != key:
+                cached = (key, self.format_line(*key, tracked_member.mention))
+            cache[tracked_member.id] = cached
+            lines.append(cached[1])
+        self._lines = cache  # also drops members that aren't tracked anymore
+
         # TODO: maybe move this to another file, somehow? also, allowing different languages would be cool
-        text = (
-            f"**Muting:** `{'Yes' if self.presence.muting else 'No'}`\n"
-            f"**Tracked users:**\n"
-        )
-        for tracked_member in self.presence.tracked_members:
-            text += (f"`{' --' if not tracked_member.is_in_vc else str(self.presence.tracked_members.index(tracked_member) + 1).rjust(3)}. "
-                     f"{tracked_member.member.display_name.ljust(max(len(tracked_member.member.display_name) for tracked_member in self.presence.tracked_members))} "
-                     f"{ ('(' + tracked_member.state.upper() + ')').rjust(9)}` "
-                     f"{tracked_member.member.mention}\n")
-
-        if self.presence.mimic:
-            text += f"**Mimicking:** {self.presence.mimic.mention}. Quickly deafen and undeafen yourself to toggle global mute.\n"
+        header = f"**Muting:** `{'Yes' if self.session.muting else 'No'}`\n"
+        if self.session.playing_cues:
+            header += "**Cues:** `On`\n"
+        header += "**Tracked users:**\n"
+
+        if self.session.mimics:
+            footer = f"**Mimicking:** {', '.join(member.mention for member in self.session.mimics)}. Quickly deafen and undeafen yourself to toggle global mute.\n"
         else:
-            text += "Not mimicking! React with :copyright: to mimic you!\n"
+            footer = "Not mimicking! React with :copyright: to mimic you!\n"
 
-        text += ("Send the index of a member to set them as dead/alive (e.g `1`). React with :arrows_counterclockwise: to reset dead members.\n"
-                 "Send the index of a member with a dash prepended to ignore/unignore them (e.g `-1`). New members are ignored by default.")
+        footer += ("Send the index of a member to set them as dead/alive (e.g `1`). React with :arrows_counterclockwise: to reset dead members.\n"
+                   "Send the index of a member with a dash prepended to ignore/unignore them (e.g `-1`). New members are ignored by default.")
 
-        await self.message.edit(content=text)
+        return paginate(header, lines, footer)
 
-class BotPresence:
-    @classmethod
-    async def create(cls, guild, client, *, text_channel_id=None, voice_channel_id=None, control_panel_id=None, excluded_roles_ids=[]):
-        self = BotPresence()
+    @staticmethod
+    def format_line(slot, name, state, name_width, mention):
+        return (f"`{' --' if slot is None else str(slot + 1).rjust(3)}. "
+                f"{name.ljust(name_width)} "
+                f"{('(' + state.value.upper() + ')').rjust(9)}` "
+                f"{mention}\n")
 
-        self.guild = guild
-        self.client = client
-        self._text_channel = None
-        self._voice_channel = None
-        self.control_panel = ControlPanel(self)
+
+def paginate(header, lines, footer, limit=MESSAGE_LIMIT):
+    pages = []
+    page = header
+    for line in lines + [footer]:
+        if len(page) + len(line) > limit:
+            pages.append(page)
+            page = ""
+        page += line
+    pages.append(page)
+    return pages
+
+
+class Session:
+    """One tracked voice channel, with its dedicated text channel, control panel, roster and mute state."""
+
+    @classmethod
+    async def create(cls, presence, *, text_channel_id=None, voice_channel_id=None, control_panel_id=None, control_panel_pages_ids=[], live=None, timings=None):
+        self = Session(presence)
 
         if text_channel_id:
             self._text_channel = self.guild.get_channel(int(text_channel_id))
         if voice_channel_id:
             self._voice_channel = self.guild.get_channel(int(voice_channel_id))
 
-        self._excluded_roles = frozenset(self.guild.get_role(int(id)) for id in excluded_roles_ids)  # frozen cause we're only assigning anyway
-        self._muting = False
-        self.muting_lock = asyncio.Lock()
-        self.mimic_undeafen_timeout = 1
-        self.mimic_deafen_time = timeit.default_timer() - self.mimic_undeafen_timeout  # Used to detect if mimicked user was muted and unmuted in same second
-        self.mute_delay = 5  # TODO: Make this scale with the amount of members in the voice channel (0.5s for each member)
-        self.last_mute_time = timeit.default_timer() - self.mute_delay
-        self.mimic = None
-        self.tracked_members = []
-
         if self.text_channel and self.voice_channel:
-            await self.track_current_voice()
+            with timed(timings, "track"):
+                if live:  # carry on with the game that was going on when the bot stopped
+                    self.restore(live)
+                else:
+                    await self.track_current_voice()
 
             if control_panel_id:
                 try:
-                    self.control_panel.message = await self.text_channel.fetch_message(int(control_panel_id))
-                    await self.control_panel.reset_reactions()
-                    await self.control_panel.update()
+                    with timed(timings, "fetch"):
+                        self.control_panel.message = await self.fetch_message(control_panel_id)
+                        for id in control_panel_pages_ids:
+                            try:
+                                self.control_panel.extra_pages.append(await self.fetch_message(id))
+                            except discord.NotFound:  # deleted pages just get sent again
+                                pass
+                    with timed(timings, "reactions"):
+                        await self.control_panel.reconcile_reactions()
                 except discord.HTTPException:
                     pass
 
         if self.control_panel.message:
             await self.control_panel.update()
 
-        await self.save()
         return self
 
+    def __init__(self, presence, text_channel=None, voice_channel=None):
+        self.presence = presence
+        self._text_channel = text_channel
+        self._voice_channel = voice_channel
+        self.control_panel = ControlPanel(self)
+
+        self._muting = False
+        self.mute_delay = self.client.mute_delay  # min seconds between toggles, queued edits get replaced so it doesn't need to cover them
+        self.last_mute_time = time.monotonic() - self.mute_delay
+        self.mimics = []  # members whose deafen gesture toggles muting
+        self.gestures = GestureRecognizer(max_hold=self.client.mimic_timeout)
+        self.speculative_mimic = self.client.speculative_mimic  # toggle on the deafen already, undo it if the undeafen doesn't follow in time
+        self._speculation = None  # (mimic id, muting before, last_mute_time before, expiry timer) until committed or undone
+        self.roster = Roster()
+
+    @property
+    def guild(self):
+        return self.presence.guild
+
+    @property
+    def client(self):
+        return self.presence.client
+
+    @property
+    def exclusions(self):
+        return self.presence.exclusions
+
+    @property
+    def mute_dispatcher(self):
+        return self.presence.mute_dispatcher
+
+    @property
+    def playing_cues(self):
+        return self.presence.voice.session is self
+
+    async def fetch_message(self, id):
+        metrics.count("api_calls", "fetch_message", self.guild.id)
+        with metrics.timed("api_seconds", "fetch_message", self.guild.id):
+            return await self.text_channel.fetch_message(int(id))
+
     @property
     def text_channel(self):
         return self._text_channel
@@ -144,7 +332,10 @@ class BotPresence:
         # TODO: check for permissions in channel here. message user personally if can't send to channel
         if self._text_channel == channel:
             raise SameValueError(channel)
+        if channel and self.client.presences.by_text_channel(channel.id):
+            raise ChannelTakenError(channel)
         self._text_channel = channel
+        self.client.presences.reindex(self)
         await self.save()
 
     @property
@@ -154,32 +345,28 @@ class BotPresence:
     async def set_voice_channel(self, channel):
         if self._voice_channel == channel:
             raise SameValueError(channel)
+        if channel and self.client.presences.by_voice_channel(channel.id):
+            raise ChannelTakenError(channel)
         # TODO: check for permissions in vc here
         self._voice_channel = channel
+        self.client.presences.reindex(self)
         await self.save()
+        if self.playing_cues:  # follow the tracked channel, moving can take a while
+            self.presence.actor.spawn(self._follow_voice_channel(channel))
 
-    @property
-    def excluded_roles(self):
-        return self._excluded_roles
-
-    async def set_excluded_roles(self, excluded_roles):
-        if self._excluded_roles == excluded_roles:
-            raise SameValueError(excluded_roles)
+    async def _follow_voice_channel(self, channel):
+        try:
+            if channel:
+                await self.presence.voice.connect(self)
+            else:
+                await self.presence.voice.disconnect()
+        except (discord.ClientException, asyncio.TimeoutError) as error:
+            print(f"Couldn't {f'move to {channel.name}' if channel else 'leave voice'} in {self.guild.name}: {error}")
+            await self.presence.voice.disconnect(force=True)
 
-        if excluded_roles.difference(self._excluded_roles):  # only if there's _new_ roles
-            new_excludes = excluded_roles.difference(self._excluded_roles)
-            # unmute and untrack all members from newly excluded role
-            await asyncio.gather(*(tracked_member.set_mute(False) for tracked_member in self.tracked_members if any((role in new_excludes for role in tracked_member.member.roles))))  # TODO: maybe make a function/method for the generator here?
-            self.tracked_members = [tracked_member for tracked_member in self.tracked_members if not any((role in new_excludes for role in tracked_member.member.roles))]
-        elif self._excluded_roles.union(excluded_roles):  # only if there's _less_ roles
-            new_unexcludes = self._excluded_roles.union(excluded_roles)
-            # track and mute newly unexcluded roles
-            for member in self.voice_channel.members:
-                if any(role in new_unexcludes for role in member.roles):
-                    self.tracked_members.append(TrackedMember(member, self))
-            await asyncio.gather(*(tracked_member.set_mute(self.muting) for tracked_member in self.tracked_members if any((role in new_unexcludes for role in tracked_member.member.roles))))
-        self._excluded_roles = excluded_roles
-        await self.save()
+    def untrack(self, tracked_member):
+        tracked_member.set_mute(False)
+        self.roster.remove(tracked_member.id)
 
     @property
     def muting(self):
@@ -187,225 +374,578 @@ class BotPresence:
 
     # TODO: rename this method to mute_all or something?
     async def set_muting(self, mute_state):
-        async with self.muting_lock:
-            self._muting = mute_state
-            await asyncio.gather(*(tracked_member.set_mute(mute_state) for tracked_member in self.tracked_members))
+        # doesn't wait for the edits, a newer toggle just replaces whatever is still queued
+        if mute_state != self._muting:
+            self.presence.voice.play(self, "mute" if mute_state else "unmute")  # plays while the edits go out
+        self._muting = mute_state
+        for tracked_member in self.roster:
+            tracked_member.set_mute(mute_state)
+        self.mute_dispatcher.begin_toggle()
+
+    async def toggle_muting(self):
+        """Toggle muting for a user, unless the last toggle was less than mute_delay ago. Returns True if it toggled."""
+        if time.monotonic() - self.last_mute_time <= self.mute_delay:
+            return False
+        await self.set_muting(not self.muting)
+        await self.control_panel.update()
+        self.last_mute_time = time.monotonic()
+        return True
 
     async def save(self):
-        async with self.client.save_lock:
-            if not str(self.guild.id) in self.client.save_data:
-                self.client.save_data[str(self.guild.id)] = {}
+        await self.presence.save()
 
-            for name, value in (("text", self.text_channel), ("voice", self.voice_channel), ("control", self.control_panel.message)):
-                if value:
-                    self.client.save_data[str(self.guild.id)][name] = value.id
-                else:
-                    self.client.save_data[str(self.guild.id)][name] = None
-            self.client.save_data[str(self.guild.id)]["exclude"] = [role.id for role in self.excluded_roles]
+    def save_data(self):
+        data = {}
+        for name, value in (("text", self.text_channel), ("voice", self.voice_channel), ("control", self.control_panel.message)):
+            if value:
+                data[name] = value.id
+            else:
+                data[name] = None
+        data["pages"] = [message.id for message in self.control_panel.extra_pages]
+        # snapshot of the game, so a restart can pick it up without unmuting everyone
+        data["live"] = {
+            "muting": self._muting,
+            "members": [tracked_member.snapshot() for tracked_member in self.roster],
+            "mimics": [mimic.id for mimic in self.mimics],
+        }
+        return data
+
+    def restore(self, live):
+        """Take muting, the roster and mimics from a snapshot, then only edit the members whose mute doesn't match."""
+        self._muting = live["muting"]
+        self.roster.restore(TrackedMember.restore(self, member_id, display_name, MemberState(state), slot)
+                            for member_id, slot, state, display_name in live["members"])
+        self.sync_roster()
+        for tracked_member in list(self.roster):
+            member = tracked_member.member
+            if member and member in self.exclusions:  # excluded while we were away
+                self.untrack(tracked_member)
+        if not self.roster.in_vc_count:  # everyone left meanwhile, start over like when the last one leaves
+            self._muting = False
+            self.roster.clear()
+        for member_id in live["mimics"]:
+            member = self.guild.get_member(member_id)
+            if member:
+                self.add_mimic(member)
+        self.reconcile()
+
+    def _track_new(self, member):
+        if member.id in self.presence.muted_away:  # we muted them before they left, they're not ignored
+            self.presence.muted_away.pop(member.id, None)
+            self.roster.add(TrackedMember(member, self)).set_mute(self.muting)
+        else:
+            self.roster.add(TrackedMember(member, self, ignore=True if member.voice.mute != self.muting else False))  # ignore new members that don't match current mute state
 
-            try:
-                with open("data.json", "w") as save_file:
-                    json.dump(self.client.save_data, save_file)
-            except FileNotFoundError:
-                with open("data.json", "x") as save_file:
-                    json.dump(self.client.save_data, save_file)
+    def _track_returned(self, tracked_member):
+        if tracked_member.id in self.presence.muted_away:
+            self.presence.muted_away.pop(tracked_member.id, None)
+            tracked_member.set_mute(self.muting)
+
+    def sync_roster(self):
+        """Catch up on members that joined or left while we weren't listening, and on member objects replaced after a
+        reconnect. Returns True if the roster changed."""
+        if self.client.low_memory and self.voice_channel:  # roles of members we haven't seen yet
+            for member in self.voice_channel.members:
+                self.exclusions.update_member(member)
+        in_channel = {member.id: member for member in self.voice_channel.members
+                      if member not in self.exclusions and member.id != self.client.user.id} if self.voice_channel else {}
+        changed = False
+        for tracked_member in list(self.roster):
+            member = in_channel.pop(tracked_member.id, None) or tracked_member.member
+            if member is None and not self.client.low_memory:  # left the guild
+                self.roster.remove(tracked_member.id)
+                changed = True
+                continue
+            if member:  # in low memory mode None also means they're not in voice, the member cache only has those
+                tracked_member.display_name = member.display_name
+            in_vc = member is not None and member.voice is not None and member.voice.channel == self.voice_channel
+            if in_vc != tracked_member.in_vc:
+                self.roster.set_in_vc(tracked_member, in_vc)
+                if in_vc:
+                    self._track_returned(tracked_member)
+                changed = True
+        for member in in_channel.values():
+            self._track_new(member)
+            changed = True
+        return changed
+
+    def reconcile(self):
+        """Queue the edits needed for everyone's server mute to match what it should be. Returns how many members drifted."""
+        drifted = 0
+        for tracked_member in self.roster:
+            member = tracked_member.member
+            voice = member.voice if member else None
+            if tracked_member.state == MemberState.IGNORED or not tracked_member.in_vc or voice is None:
+                continue
+            if self.mute_dispatcher.expected_mute(tracked_member.id) is not None:
+                continue  # already being edited
+            if voice.mute != (tracked_member.state == MemberState.DEAD or self.muting):
+                drifted += 1
+                tracked_member.set_mute(self.muting)
+        return drifted
+
+    async def resume(self):
+        """Pick up the guild's new channel and member objects after a reconnect, and whatever changed meanwhile."""
+        if self._text_channel:
+            self._text_channel = self.guild.get_channel(self._text_channel.id)
+        if self._voice_channel:
+            self._voice_channel = self.guild.get_channel(self._voice_channel.id)
+        self.client.presences.reindex(self)
+        for mimic in list(self.mimics):
+            member = self.guild.get_member(mimic.id)
+            if member and member.voice and member.voice.channel == self.voice_channel:
+                self.mimics[self.mimics.index(mimic)] = member
+            else:
+                await self.remove_mimic(mimic)
+        self.sync_roster()
+        self.reconcile()
+        await self.control_panel.update()
 
     async def track_current_voice(self):
         await self.set_muting(False)
-        self.tracked_members = [TrackedMember(member, self, ignore=True if member.voice.mute != self.muting else False) for member in self.voice_channel.members if not any((role in self.excluded_roles for role in member.roles))]
+        self.roster.clear()
+        for member in self.voice_channel.members:
+            if member not in self.exclusions and member.id != self.client.user.id:
+                self._track_new(member)
+
+    async def setup(self, message):
+        """Make the message's channel this session's text channel and track the author's voice channel."""
+        # TODO: DRY this
+        if message.author.voice:
+            try:
+                await self.set_text_channel(message.channel)
+                await self.set_voice_channel(message.author.voice.channel)
+                await self.track_current_voice()
+                self.presence.reply(self.text_channel, f"All good! Listening for commands only on {self.text_channel.mention} and tracking {self.voice_channel.name}.", panel=self.control_panel)
+            except SameValueError as error:
+                if error.args[0] == message.channel:
+                    try:
+                        await self.set_voice_channel(message.author.voice.channel)
+                        await self.track_current_voice()
+                        self.presence.reply(self.text_channel, f"All good! Listening for commands only on {self.text_channel.mention} and tracking {self.voice_channel.name}.", panel=self.control_panel)
+                    except SameValueError as error:
+                        if error.args[0] == message.author.voice.channel:
+                            self.presence.reply(self.text_channel, f"Already set up! This is {self.client.user.name}'s channel and currently tracking {self.voice_channel.name}.")
+                    except ChannelTakenError as error:
+                        self.presence.reply(message.channel, f"Error! {error.channel.name} is already tracked from another channel.")
+                elif error.args[0] == message.author.voice.channel:
+                    self.presence.reply(self.text_channel, f"All good! Listening for commands only on {self.text_channel.mention} and tracking {self.voice_channel.name}.", panel=self.control_panel)
+            except ChannelTakenError as error:
+                self.presence.reply(message.channel, f"Error! {error.channel.mention if error.channel == message.channel else error.channel.name} is already used by another {self.client.user.name} session.")
+        else:
+            self.presence.reply(message.channel, f"Error! User {message.author.mention} not in any voice channel on this server! Please join a voice channel first!")
+
+    async def close(self):
+        """Stop tracking: unmute everyone and delete the control panel."""
+        for tracked_member in list(self.roster):
+            self.untrack(tracked_member)
+        if self.playing_cues:
+            await self.presence.voice.disconnect()
+        await self.control_panel.delete()
 
     # TODO: maybe it's a good idea to use ext.commands instead of manually doing this stuff
     async def on_message(self, message):
-        if message.guild != self.guild:
-            return
-        if message.content == "among:help":
-            response = ("**Quick start**\n"
-                        "```markdown\n"
-                        f"1. Create a dedicated text channel for {self.client.user.name}.\n"
-                        "2. Join the voice channel you want to track.\n"
-                        "3. Type among:setup in the dedicated text channel.\n"
-                        "```\n"
-                        "**Global commands**\n"
-                        "```yaml\n"
-                        "among:help : Sends this help text.\n"
-                        "among:setup : Runs among:text and among:vc\n"
-                        "among:text : Sets the current channel as the dedicated text channel.\n"
-                        "```\n"
-                        "**Commands for dedicated text channel**\n"
-                        "```yaml\n"
-                        "among:vc : Sets the current voice channel as the tracked channel.\n"
-                        "among:excluderole : Exclude mentioned roles from muting.\n"
-                        "among:unexcluderole  : Stop excluding mentioned roles.\n"
-                        "```\n"
-                        f"This bot is Free Software. Get the source code from here: {SOURCE_CODE_URL}\n")
-            await message.channel.send(response)
-        elif message.content == "among:setup":  # TODO: make this a method?
-            # TODO: DRY this
-            if message.author.voice:
-                try:
-                    await self.set_text_channel(message.channel)
+        if message.content == "among:vc":
+            try:
+                if message.author.voice:
                     await self.set_voice_channel(message.author.voice.channel)
                     await self.track_current_voice()
-                    await self.text_channel.send(f"All good! Listening for commands only on {self.text_channel.mention} and tracking {self.voice_channel.name}.")
-                    await self.control_panel.send_new()
-                except SameValueError as error:
-                    if error.args[0] == message.channel:
-                        try:
-                            await self.set_voice_channel(message.author.voice.channel)
-                            await self.track_current_voice()
-                            await self.text_channel.send(f"All good! Listening for commands only on {self.text_channel.mention} and tracking {self.voice_channel.name}.")
-                            await self.control_panel.send_new()
-                        except SameValueError as error:
-                            if error.args[0] == message.author.voice.channel:
-                                await self.text_channel.send(f"Already set up! This is {self.client.user.name}'s channel and currently tracking {self.voice_channel.name}.")
-                    elif error.args[0] == message.author.voice.channel:
-                        await self.text_channel.send(f"All good! Listening for commands only on {self.text_channel.mention} and tracking {self.voice_channel.name}.")
-                        await self.control_panel.send_new()
-            else:
-                await message.channel.send(f"Error! User {message.author.mention} not in any voice channel on this server! Please join a voice channel first!")
-        elif message.content == "among:text":
-            try:
-                await self.set_text_channel(message.channel)
-                await self.text_channel.send(f"Current channel {self.text_channel.mention} set as {self.client.user.name}'s channel!\n"
-                                             f"Now accepting commands here.")
-                if self.voice_channel:
-                    await self.control_panel.send_new()
+                    self.presence.reply(self.text_channel, f"{self.voice_channel.name} set as tracked voice channel!", panel=self.control_panel)
+                else:
+                    await self.set_voice_channel(None)
+                    if self.control_panel.message:
+                        await self.control_panel.delete()
+                        self.client.presences.reindex(self)
+                        await self.save()
+                    self.presence.reply(self.text_channel, f"User {message.author.mention} not in any voice channel on this server. Stopped tracking voice channel.")
             except SameValueError:
-                await self.text_channel.send(f"Error! This channel is already {self.client.user.name}'s channel.")
-        elif message.channel == self.text_channel:
-            if message.content == "among:vc":
+                if self.voice_channel:
+                    self.presence.reply(self.text_channel, f"Error! {self.voice_channel.name} is already tracked. To untrack, run `among:vc` while not connected to any channel.")
+                else:
+                    self.presence.reply(self.text_channel, f"Error! User {message.author.mention} not in any voice channel on this server! Please join a voice channel first!")
+            except ChannelTakenError as error:
+                self.presence.reply(self.text_channel, f"Error! {error.channel.name} is already tracked from another channel.")
+        elif message.content == "among:stats":
+            stats = metrics.guild_summary(self.guild.id) if metrics.enabled else "Metrics are disabled."
+            self.presence.reply(self.text_channel, f"**Stats for {self.guild.name}**\n```yaml\n{(stats or 'Nothing recorded yet.')[:MESSAGE_LIMIT - 100]}\n```")
+        elif actions.by_command(message.content):
+            await actions.by_command(message.content).handler(self, message.author)
+        elif message.content == "among:unassign":
+            await self.presence.remove_session(self)
+            self.presence.reply(message.channel, f"Stopped tracking {self.voice_channel.name if self.voice_channel else 'voice'} from this channel.")
+        # TODO: DRY this (but how?)
+        elif message.content.startswith("among:excluderole"):
+            if message.role_mentions:
                 try:
-                    if message.author.voice:
-                        await self.set_voice_channel(message.author.voice.channel)
-                        await self.track_current_voice()
-                        await self.text_channel.send(f"{self.voice_channel.name} set as tracked voice channel!")
-                        await self.control_panel.send_new()
-                    else:
-                        await self.set_voice_channel(None)
-                        if self.control_panel.message:
-                            await self.control_panel.message.delete()
-                            self.control_panel.message = None
-                            await self.save()
-                        await self.text_channel.send(f"User {message.author.mention} not in any voice channel on this server. Stopped tracking voice channel.")
+                    await self.presence.set_excluded_roles(self.presence.excluded_roles.union(message.role_mentions))
+                    self.presence.reply(self.text_channel, f"Now excluding roles:\n{' '.join((role.mention for role in self.presence.excluded_roles))}")
                 except SameValueError:
-                    if self.voice_channel:
-                        await self.text_channel.send(f"Error! {self.voice_channel.name} is already tracked. To untrack, run `among:vc` while not connected to any channel.")
+                    self.presence.reply(self.text_channel, "Error! All mentioned roles were already excluded.")
+            else:
+                self.presence.reply(self.text_channel, "Error! No role mentions detected!\nUsage: `among:excluderole <role mention>...`")
+        elif message.content.startswith("among:unexcluderole"):
+            if message.role_mentions:
+                try:
+                    await self.presence.set_excluded_roles(self.presence.excluded_roles.difference(message.role_mentions))
+                    if self.presence.excluded_roles:
+                        self.presence.reply(self.text_channel, f"Now excluding roles:\n{' '.join((role.mention for role in self.presence.excluded_roles))}")
                     else:
-                        await self.text_channel.send(f"Error! User {message.author.mention} not in any voice channel on this server! Please join a voice channel first!")
-            # TODO: DRY this (but how?)
-            elif message.content.startswith("among:excluderole"):
-                if message.role_mentions:
-                    try:
-                        await self.set_excluded_roles(self.excluded_roles.union(message.role_mentions))
-                        await self.text_channel.send(f"Now excluding roles:\n{' '.join((role.mention for role in self.excluded_roles))}")
-                        await self.control_panel.update()
-                    except SameValueError:
-                        await self.text_channel.send("Error! All mentioned roles were already excluded.")
-                else:
-                    await self.text_channel.send("Error! No role mentions detected!\nUsage: `among:excluderole <role mention>...`")
-            elif message.content.startswith("among:unexcluderole"):
-                if message.role_mentions:
-                    try:
-                        await self.set_excluded_roles(self.excluded_roles.difference(message.role_mentions))
-                        if self.excluded_roles:
-                            await self.text_channel.send(f"Now excluding roles:\n{' '.join((role.mention for role in self.excluded_roles))}")
-                        else:
-                            await self.text_channel.send("No longer excluding any roles.")
-                        await self.control_panel.update()
-                    except SameValueError:
-                        await self.text_channel.send("Error! None of the mentioned roles were excluded.")
-                else:
-                    await self.text_channel.send("Error! No role mentions detected!\nUsage: `among:excluderole <role mention>...`")
-            elif all(received_index.isdigit() or (received_index and received_index[0] == "-" and received_index[1:].isdigit()) for received_index in message.content.split(" ")):
-                for received_index in set(message.content.split(" ")):
-                    index = abs(int(received_index)) - 1
-                    if index in range(len(self.tracked_members)):
-                        if received_index[0] == "-":  # toggle ignored
-                            if self.tracked_members[index].state == "ignored":
-                                self.tracked_members[index].state = "alive"
-                            else:
-                                self.tracked_members[index].state = "ignored"
-                        else:                   # toggle dead
-                            if self.tracked_members[index].state == "alive":
-                                self.tracked_members[index].state = "dead"
-                            elif self.tracked_members[index].state == "dead":
-                                self.tracked_members[index].state = "alive"
-                await self.set_muting(self.muting)
-                await self.control_panel.update()
-                await message.delete()
-
-    async def set_mimic(self, member):
-        if member:
-            if member.voice and member.voice.channel == self.voice_channel:
-                self.mimic = member
-                await self.set_muting(self.muting)  # TODO: maybe set_muting() with no args should default to current mute (or maybe set_muting shouldn't do all it does? (or maybe it should be renamed??))
-                return True  # Remove return values and use exceptions?
+                        self.presence.reply(self.text_channel, "No longer excluding any roles.")
+                except SameValueError:
+                    self.presence.reply(self.text_channel, "Error! None of the mentioned roles were excluded.")
             else:
-                return False
+                self.presence.reply(self.text_channel, "Error! No role mentions detected!\nUsage: `among:excluderole <role mention>...`")
+        elif all(received_index.isdigit() or (received_index and received_index[0] == "-" and received_index[1:].isdigit()) for received_index in message.content.split(" ")):
+            for received_index in set(message.content.split(" ")):
+                tracked_member = self.roster.by_slot(abs(int(received_index)) - 1)
+                if tracked_member:
+                    if received_index[0] == "-":  # toggle ignored
+                        if tracked_member.state == MemberState.IGNORED:
+                            self.roster.set_state(tracked_member, MemberState.ALIVE)
+                        else:
+                            self.roster.set_state(tracked_member, MemberState.IGNORED)
+                    else:                   # toggle dead
+                        if tracked_member.state == MemberState.ALIVE:
+                            self.roster.set_state(tracked_member, MemberState.DEAD)
+                        elif tracked_member.state == MemberState.DEAD:
+                            self.roster.set_state(tracked_member, MemberState.ALIVE)
+            await self.set_muting(self.muting)
+            await self.control_panel.update()
+            self.presence.actor.spawn(message.delete())  # don't hold up the guild's next events for cleanup
+
+    def add_mimic(self, member):
+        if member.voice and member.voice.channel == self.voice_channel and member not in self.mimics:
+            self.mimics.append(member)
+            return True  # Remove return values and use exceptions?
+        return False
+
+    async def remove_mimic(self, member):
+        self.mimics.remove(member)
+        self.gestures.cancel(member.id)
+        if self._speculation and self._speculation[0] == member.id:
+            await self._undo_speculation()
+
+    async def _mimic_deafened(self, member):
+        if self._speculation or time.monotonic() - self.last_mute_time <= self.mute_delay:
+            return  # another mimic's gesture is already toggling, or too soon after the last toggle
+        self.gestures.deafen(member.id)
+        if self.speculative_mimic:
+            # most deafens by a mimic are the gesture, so start sending the edits now instead of after the undeafen
+            expiry = asyncio.get_running_loop().call_later(self.gestures.max_hold, self.presence.actor.post, "gesture_expired", self._gesture_expired, member)
+            self._speculation = (member.id, self.muting, self.last_mute_time, expiry)
+            self.last_mute_time = time.monotonic()
+            await self.set_muting(not self.muting)
+
+    async def _mimic_undeafened(self, member):
+        """Returns True if the undeafen completed a gesture."""
+        if not self.gestures.undeafen(member.id):
+            if self._speculation and self._speculation[0] == member.id:
+                await self._undo_speculation()
+            return False
+        if self._speculation:  # already toggled on the deafen, keep it
+            self._speculation[3].cancel()
+            self._speculation = None
+            await self.control_panel.update()
         else:
-            self.mimic = None
+            await self.toggle_muting()
+        return True
+
+    async def _gesture_expired(self, member):
+        if self._speculation and self._speculation[0] == member.id:  # no undeafen in time, so it wasn't the gesture
+            self.gestures.cancel(member.id)
+            await self._undo_speculation()
+
+    async def _undo_speculation(self):
+        member_id, muting, last_mute_time, expiry = self._speculation
+        self._speculation = None
+        expiry.cancel()
+        self.last_mute_time = last_mute_time
+        await self.set_muting(muting)  # the dispatcher drops the edits that weren't sent yet and reverts the others
 
     async def on_voice_state_update(self, member, before, after):
-        if member.guild != self.guild or self.voice_channel is None or any((role in self.excluded_roles for role in member.roles)):
+        if self.voice_channel is None:
+            return
+        if self.client.low_memory:  # no member updates without the members intent, voice states are where we see roles
+            self.exclusions.update_member(member)
+        if member in self.exclusions:
             return
 
-        muting_in_progress = self.muting_lock.locked()
-
-        if member == self.mimic:
+        if member in self.mimics:
             if after.channel == self.voice_channel:  # Status changed inside channel
                 if not before.self_deaf and after.self_deaf:    # Deafened
-                    self.mimic_deafen_time = timeit.default_timer()
+                    await self._mimic_deafened(member)
                 elif before.self_deaf and not after.self_deaf:  # Undeafened
-                    if (timeit.default_timer() - self.mimic_deafen_time) < self.mimic_undeafen_timeout:
-                        if (timeit.default_timer() - self.last_mute_time) > self.mute_delay:
-                            await self.set_muting(not self.muting)
-                            await self.control_panel.update()
-                            self.last_mute_time = timeit.default_timer()
-                            return  # because for some reason member.after is changed to muted (from outside) but muting_in_progress is still false
+                    if await self._mimic_undeafened(member):
+                        return  # the gesture itself is handled, the mute edits it causes come back as separate updates
             else:                                    # Whoops, not in channel anymore?
-                await self.set_mimic(None)
+                await self.remove_mimic(member)
                 await self.control_panel.update()
 
         if before.channel != after.channel:
+            tracked_member = self.roster.get(member.id)
             if after.channel == self.voice_channel:
-                if member not in (tracked_member.member for tracked_member in self.tracked_members):
-                    self.tracked_members.append(TrackedMember(member, self, ignore=True if member.voice.mute != self.muting else False))  # ignore new members that don't match current mute state
+                if tracked_member:
+                    tracked_member.display_name = member.display_name
+                    self.roster.set_in_vc(tracked_member, True)
+                    self._track_returned(tracked_member)
+                else:
+                    self._track_new(member)
                 await self.control_panel.update()
             elif after.channel != self.voice_channel:
-                if not any((tracked_member.is_in_vc for tracked_member in self.tracked_members)):  # reset indexes when all managed members leave
+                if tracked_member:
+                    expected_mute = self.mute_dispatcher.expected_mute(member.id)
+                    self.mute_dispatcher.cancel(member.id)  # can't edit members out of voice
+                    self.roster.set_in_vc(tracked_member, False)
+                    if tracked_member.state != MemberState.IGNORED and (before.mute or expected_mute):
+                        # muted by us, unmute them once they're back in voice, wherever that is
+                        self.presence.muted_away[member.id] = time.time()
+                        if after.channel and not self.client.presences.by_voice_channel(after.channel.id):
+                            self.presence.unmute_returned(member)
+                if not self.roster.in_vc_count:  # reset indexes when all managed members leave
                     await self.set_muting(False)
-                    self.tracked_members = []
+                    self.roster.clear()
                 await self.control_panel.update()
 
-        if before.mute != after.mute and after.channel == self.voice_channel and not muting_in_progress:
-            for tracked_member in self.tracked_members:
-                if member == tracked_member.member:
-                    tracked_member.state = "ignored"
+        if before.mute != after.mute and not self.mute_dispatcher.echoed(member.id, after.mute) and after.channel == self.voice_channel:
+            tracked_member = self.roster.get(member.id)
+            if tracked_member:
+                expected_mute = self.mute_dispatcher.expected_mute(member.id)
+                if after.mute != (tracked_member.mute if expected_mute is None else expected_mute):  # not our own edit
+                    self.roster.set_state(tracked_member, MemberState.IGNORED)
                     await self.control_panel.update()
-                    break
 
     async def on_reaction_add(self, emoji, message_id, member):
-        if member.guild != self.guild or self.control_panel.message is None:
+        if self.control_panel.message is None:
             return
         if message_id == self.control_panel.message.id:  # TODO: why doesn't this work without .id?
-            if emoji.name == '🔈':
-                if (timeit.default_timer() - self.last_mute_time) > self.mute_delay:  # TODO move this into set_muting() but don't call set_muting() from places a user wouldn't
-                    await self.set_muting(not self.muting)
-                    await self.control_panel.update()
-                    self.last_mute_time = timeit.default_timer()
-            elif emoji.name == '©':
-                if self.mimic is None:
-                    await self.set_mimic(member)
-                    await self.control_panel.update()
-                elif member == self.mimic:
-                    await self.set_mimic(None)
-                    await self.control_panel.update()
-            elif emoji.name == '🔄':
-                for tracked_member in self.tracked_members:
-                    if tracked_member.state == "dead":
-                        tracked_member.state = "alive"
-                await self.set_muting(False)
-                await self.control_panel.update()
-            # TODO: fetch_message() exception handling (idk if it matters in here tho)
-            message = await self.text_channel.fetch_message(message_id)
-            await message.remove_reaction(emoji, member)
+            if not self.control_panel.click(emoji, member):
+                return
+            action = actions.by_emoji(emoji.name)
+            if action:
+                await action.handler(self, member)
+
+
+class BotPresence:
+    """The bot in one guild: settings shared by the whole guild and the guild's sessions.
+
+    The first session is the one among:setup and among:text configure, among:assign adds more.
+    """
+
+    @classmethod
+    async def create(cls, guild, client, *, sessions=[], excluded_roles_ids=[], muted_away=[], timings=None):
+        self = BotPresence()
+
+        self.guild = guild
+        self.client = client
+        self.exclusions = ExclusionCache(self.guild.get_role(int(id)) for id in excluded_roles_ids)
+        self.mute_dispatcher = MuteDispatcher(guild, rate=client.mute_rate[0], per=client.mute_rate[1])  # shared, the member edit rate limit is per guild
+        self.actor = GuildActor(self, batching=client.batch_events)  # the client posts this guild's events to it
+        self.voice = GuildVoice(guild, client.cues)
+        self.sessions = []
+        self.muted_away = dict(muted_away)  # member id -> when they left voice while we had them muted
+        self._saved_data = None
+        self._saved_at = 0
+
+        for session_data in sessions:
+            self.sessions.append(await Session.create(self, **session_data, timings=timings))
+
+        if any(session_data.get("control_panel_id") and not session.control_panel.message for session, session_data in zip(self.sessions, sessions)):
+            await self.save()  # a panel is gone, forget about it
+        return self
+
+    async def resume(self, guild):
+        """Carry on in a new guild object after the gateway reconnected, keeping the sessions and their state."""
+        self.guild = guild
+        self.mute_dispatcher.guild = guild
+        self.voice.guild = guild
+        self.exclusions = ExclusionCache(guild.get_role(role.id) for role in self.excluded_roles)  # member roles may have changed too
+        for session in self.sessions:
+            await session.resume()
+
+    async def reconcile(self):
+        """Fix whatever missed events left out of sync."""
+        for session in self.sessions:
+            changed = session.sync_roster()
+            drifted = session.reconcile()
+            metrics.count("drift_corrections", guild_id=self.guild.id, value=drifted)
+            if changed or drifted:
+                await session.control_panel.update()
+        # forget members that never came back, without the members intent we don't hear about the ones that left the guild
+        expired = time.time() - self.client.muted_away_max_age
+        self.muted_away = {member_id: since for member_id, since in self.muted_away.items() if since > expired}
+        for member_id in list(self.muted_away):  # came back to a channel no session tracks
+            member = self.guild.get_member(member_id)
+            if member and member.voice and not self.client.presences.by_voice_channel(member.voice.channel.id):
+                self.unmute_returned(member)
+
+    def unmute_returned(self, member):
+        """Unmute a member we muted in a session's channel, now that they're in another one."""
+        self.muted_away.pop(member.id, None)
+        if member.voice and member.voice.mute:
+            metrics.count("returned_unmutes", guild_id=self.guild.id)
+            self.mute_dispatcher.request(TrackedMember(member, self), False)  # shares the guild's edit rate limit
+
+    async def on_voice_state_update(self, member, before, after):
+        """For members in muted_away that joined a channel no session tracks."""
+        if member.id in self.muted_away and after.channel and not self.client.presences.by_voice_channel(after.channel.id):
+            self.unmute_returned(member)
+
+    def reply(self, channel, content, *, panel=None):
+        """Send a message, and then a new control panel if one is given, without holding up the guild's next events."""
+        async def send():
+            await channel.send(content)
+            if panel:
+                await panel.send_new()
+        self.actor.spawn(send())
+
+    async def add_session(self, text_channel=None, voice_channel=None):
+        session = Session(self, text_channel, voice_channel)
+        self.sessions.append(session)
+        self.client.presences.reindex(session)
+        return session
+
+    def hold(self):
+        """Hold back mute edits and panel refreshes while the actor handles a batch."""
+        self.mute_dispatcher.hold()
+        for session in self.sessions:
+            session.control_panel.hold()
+
+    def release(self):
+        self.mute_dispatcher.release()
+        for session in self.sessions:
+            session.control_panel.release()
+
+    async def remove_session(self, session):
+        self.sessions.remove(session)
+        self.client.presences.unindex(session)
+        session.control_panel.release()  # release() won't reach it anymore
+        await session.close()
+        await self.save()
+
+    @property
+    def excluded_roles(self):
+        return self.exclusions.roles
+
+    async def set_excluded_roles(self, excluded_roles):
+        if self.exclusions.roles == excluded_roles:
+            raise SameValueError(excluded_roles)
+
+        previously_excluded = self.exclusions.member_ids
+        self.exclusions.set_roles(excluded_roles)
+        await self._exclusions_changed(previously_excluded)
+        await self.save()
+
+    async def _exclusions_changed(self, previously_excluded):
+        for session in self.sessions:
+            # unmute and untrack members that are excluded now
+            for tracked_member in list(session.roster):
+                member = tracked_member.member
+                if member and member in self.exclusions:
+                    session.untrack(tracked_member)
+            # track and mute members that aren't excluded anymore
+            if session.voice_channel:
+                for member in session.voice_channel.members:
+                    if member.id in previously_excluded and member not in self.exclusions and member.id != self.client.user.id:
+                        session.roster.add(TrackedMember(member, session)).set_mute(session.muting)
+            await session.control_panel.update()
+
+    def save_data(self):
+        return {
+            "sessions": [session.save_data() for session in self.sessions],
+            "exclude": [role.id for role in self.excluded_roles],
+            "muted_away": sorted(self.muted_away.items()),
+        }
+
+    async def save(self, *, force=False):
+        """Save settings and the game snapshot. Unchanged data is skipped, until it's old enough that a restart wouldn't
+        trust it anymore."""
+        data = self.save_data()
+        now = time.time()
+        if not force and data == self._saved_data and now - self._saved_at < self.client.snapshot_max_age / 2:
+            return
+        self._saved_data, self._saved_at = data, now
+        self.client.store.save(self.guild.id, {**data, "saved_at": now})  # written later, off the event loop
+
+    async def on_message(self, message):
+        """Handle the commands that work in any channel. Session commands go to Session.on_message()."""
+        if message.content == "among:help":
+            response = ("**Quick start**\n"
+                        "```markdown\n"
+                        f"1. Create a dedicated text channel for {self.client.user.name}.\n"
+                        "2. Join the voice channel you want to track.\n"
+                        "3. Type among:setup in the dedicated text channel.\n"
+                        "```\n"
+                        "**Global commands**\n"
+                        "```yaml\n"
+                        "among:help : Sends this help text.\n"
+                        "among:setup : Runs among:text and among:vc\n"
+                        "among:text : Sets the current channel as the dedicated text channel.\n"
+                        "among:assign : Tracks your voice channel from the current channel, in addition to any others. For servers running several lobbies.\n"
+                        "```\n"
+                        "**Commands for dedicated text channel**\n"
+                        "```yaml\n"
+                        "among:vc : Sets the current voice channel as the tracked channel.\n"
+                        "among:unassign : Stops tracking from the current channel.\n"
+                        "among:stats : Sends API call counts and latencies for this server.\n"
+                        + "".join(f"{action.command} : {action.description} Same as the {action.emoji} reaction.\n" for action in ACTIONS) +
+                        "among:excluderole : Exclude mentioned roles from muting.\n"
+                        "among:unexcluderole  : Stop excluding mentioned roles.\n"
+                        "```\n"
+                        f"This bot is Free Software. Get the source code from here: {SOURCE_CODE_URL}\n")
+            self.reply(message.channel, response)
+        elif message.content == "among:setup":  # TODO: make this a method?
+            session = self.client.presences.by_text_channel(message.channel.id)
+            if session is None:
+                session = self.sessions[0] if self.sessions else await self.add_session()
+            await session.setup(message)
+        elif message.content == "among:assign":
+            session = self.client.presences.by_text_channel(message.channel.id)
+            if session is None:
+                if not message.author.voice:  # don't leave an empty session behind
+                    self.reply(message.channel, f"Error! User {message.author.mention} not in any voice channel on this server! Please join a voice channel first!")
+                    return
+                if self.client.presences.by_voice_channel(message.author.voice.channel.id):
+                    self.reply(message.channel, f"Error! {message.author.voice.channel.name} is already tracked from another channel.")
+                    return
+                session = await self.add_session()
+            await session.setup(message)
+        elif message.content == "among:text":
+            session = self.sessions[0] if self.sessions else await self.add_session()
+            try:
+                await session.set_text_channel(message.channel)
+                self.reply(session.text_channel, f"Current channel {session.text_channel.mention} set as {self.client.user.name}'s channel!\n"
+                                                 f"Now accepting commands here.", panel=session.control_panel if session.voice_channel else None)
+            except SameValueError:
+                self.reply(session.text_channel, f"Error! This channel is already {self.client.user.name}'s channel.")
+            except ChannelTakenError:
+                self.reply(message.channel, f"Error! This channel is already used by another {self.client.user.name} session.")
+
+    async def on_member_update(self, before, after):
+        if before.display_name != after.display_name:
+            for session in self.sessions:
+                tracked_member = session.roster.get(after.id)
+                if tracked_member:
+                    tracked_member.display_name = after.display_name
+                    await session.control_panel.update()
+        if before.roles == after.roles:
+            return
+        self.exclusions.update_member(after)
+        for session in self.sessions:
+            tracked_member = session.roster.get(after.id)
+            if tracked_member and after in self.exclusions:
+                session.untrack(tracked_member)
+                await session.control_panel.update()
+            elif not tracked_member and after not in self.exclusions and after.voice and after.voice.channel == session.voice_channel:
+                session.roster.add(TrackedMember(after, session)).set_mute(session.muting)
+                await session.control_panel.update()
+
+    async def on_member_remove(self, member):
+        self.exclusions.remove_member(member.id)
+        self.muted_away.pop(member.id, None)
+
+    async def on_guild_role_delete(self, role):
+        if role in self.excluded_roles:
+            previously_excluded = self.exclusions.member_ids
+            self.exclusions.remove_role(role)
+            await self._exclusions_changed(previously_excluded)
+            await self.save()
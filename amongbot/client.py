@@ -1,59 +1,223 @@
 import asyncio
+import time
 import discord
 
 from .botpresence import BotPresence
+from .router import PresenceRouter
+from .storage import GuildStore
+from .cues import CueCache
+from .control import ControlServer
+from .timing import timed
+from .metrics import metrics
+from .constants import GLOBAL_COMMANDS
 
 
 class Client(discord.Client):
-    def __init__(self, *args, presences=[], save_data={}, **kwargs):
+    def __init__(self, *args, presences=(), store=None, startup_concurrency=10, mute_rate=(10, 10), batch_events=True,
+                 mute_delay=1, mimic_timeout=1, speculative_mimic=False, reconcile_interval=60, snapshot_interval=30, snapshot_max_age=600,
+                 muted_away_max_age=24 * 60 * 60, cues_path="cues", metrics_port=None,
+                 control_port=None, control_socket=None, control_token=None, low_memory=False, **kwargs):
+        # Low memory mode is for very large guilds: only the gateway events the bot needs, and only members in voice
+        # channels cached. Without the members intent there are no member updates, and excluded roles are picked up from
+        # members' voice state updates instead of the roles' member lists.
+        self.low_memory = low_memory
+        if low_memory:
+            kwargs.setdefault("intents", discord.Intents(guilds=True, voice_states=True, guild_messages=True, guild_reactions=True, message_content=True))
+            kwargs.setdefault("member_cache_flags", discord.MemberCacheFlags.from_intents(kwargs["intents"]))  # voice only
+            kwargs.setdefault("chunk_guilds_at_startup", False)
+        else:
+            intents = discord.Intents.default()
+            intents.members = True  # privileged, for excluded roles and member updates
+            intents.message_content = True  # privileged, for commands
+            kwargs.setdefault("intents", intents)
         super().__init__(*args, **kwargs)
 
-        self.presences = presences
-        self.save_data = save_data
-        self.save_lock = asyncio.Lock()
+        self.metrics_port = metrics_port  # serve Prometheus metrics on localhost if set
+        # control socket for external programs, on a localhost port or a Unix socket path
+        self.control_port = control_port
+        self.control_socket = control_socket
+        self.control = ControlServer(self, token=control_token) if control_port is not None or control_socket else None
+
+        self.startup_concurrency = startup_concurrency  # guilds set up at the same time in on_ready
+        self.mute_rate = mute_rate  # (edits, per seconds) allowed per guild
+        self.batch_events = batch_events  # let guild actors handle queued events as one batch
+
+        # defaults for new sessions
+        self.mute_delay = mute_delay  # min seconds between toggles
+        self.mimic_timeout = mimic_timeout  # max seconds between a mimic's deafen and undeafen
+        self.speculative_mimic = speculative_mimic  # start toggling on a mimic's deafen already
+
+        self.reconcile_interval = reconcile_interval  # seconds between checks for mute states that drifted, None to disable
+        self._reconciler = None
+        # the game in every session is saved this often, and restored on startup if the save isn't older than max age
+        self.snapshot_interval = snapshot_interval  # seconds, None to only save on changes to the settings and on close
+        self.snapshot_max_age = snapshot_max_age
+        self.muted_away_max_age = muted_away_max_age  # seconds members that left voice muted get to come back and be unmuted
+        self._snapshotter = None
+
+        self.presences = PresenceRouter(presences)
+        self.store = store if store else GuildStore()
+        self.cues = CueCache(cues_path)  # loaded in on_ready
+
+    async def close(self):
+        if self._reconciler:
+            self._reconciler.cancel()
+        if self._snapshotter:
+            self._snapshotter.cancel()
+        for presence in self.presences:
+            presence.actor.close()
+        for presence in self.presences:  # last snapshot, nothing changes it anymore
+            await presence.save(force=True)
+        await self.store.close()  # write out anything still pending
+        metrics.close()
+        if self.control:
+            self.control.close()
+        await super().close()
 
     # Events
     async def on_ready(self):
         print(f"{self.user.name} is online!")
+        if self.metrics_port and not metrics.serving:
+            await metrics.serve(port=self.metrics_port)
+        if self.control and not self.control.serving:
+            await self.control.start(port=self.control_port, path=self.control_socket)
+        if not self.cues:
+            await self.cues.load()
+            if self.cues:
+                print(f"Loaded cues: {', '.join(self.cues.frames)}")
+        if self.reconcile_interval and self._reconciler is None:
+            self._reconciler = asyncio.create_task(self._reconcile_loop())
+        if self.snapshot_interval and self._snapshotter is None:
+            self._snapshotter = asyncio.create_task(self._snapshot_loop())
+        start = time.perf_counter()
+        timings = {}
+        semaphore = asyncio.Semaphore(self.startup_concurrency)
+
+        # on_ready comes again after every reconnect that couldn't resume the old gateway session. Guilds we already have
+        # a presence for keep it, with their sessions and state, and only pick up the new guild objects.
+        guild_ids = {guild.id for guild in self.guilds}
+        for presence in self.presences:
+            if presence.guild.id not in guild_ids:  # removed while we were disconnected
+                self.presences.remove(presence.guild.id)
+                presence.actor.close()
+        resumed = 0
         for guild in self.guilds:
-            if str(guild.id) in self.save_data:
+            presence = self.presences.by_guild(guild.id)
+            if presence:
+                presence.actor.post("resume", presence.resume, guild)  # after whatever events it's still handling
+                resumed += 1
+
+        async def create_presence(guild):
+            async with semaphore:
+                await self.create_presence(guild, timings)
+
+        await asyncio.gather(*(create_presence(guild) for guild in self.guilds if not self.presences.by_guild(guild.id)))
+
+        # phases overlap between guilds, so these are summed over all guilds and can add up to more than the total
+        phases = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in timings.items())
+        print(f"Set up {len(self.presences) - resumed} guilds and resumed {resumed} in {time.perf_counter() - start:.2f}s ({phases})")
+
+    async def create_presence(self, guild, timings=None):
+        with timed(timings, "load"):
+            save_data = await self.store.load(guild.id)
+        try:
+            if save_data:
+                # a stale snapshot could undo whatever happened in the game since, start those sessions over instead
+                fresh = time.time() - save_data.get("saved_at", 0) <= self.snapshot_max_age
                 # TODO: is the stuff below pythonic? (appending and instantiating at the same time)
-                self.presences.append(await BotPresence.create(
+                self.presences.add(await BotPresence.create(
                     guild,
                     self,
-                    text_channel_id=self.save_data[str(guild.id)]["text"],
-                    voice_channel_id=self.save_data[str(guild.id)]["voice"],
-                    control_panel_id=self.save_data[str(guild.id)]["control"],
-                    excluded_roles_ids=self.save_data[str(guild.id)]["exclude"]
+                    sessions=[{
+                        "text_channel_id": session_data["text"],
+                        "voice_channel_id": session_data["voice"],
+                        "control_panel_id": session_data["control"],
+                        "control_panel_pages_ids": session_data.get("pages", []),
+                        "live": session_data.get("live") if fresh else None
+                    } for session_data in save_data.get("sessions", [save_data])],  # older saves had a single session at the top level
+                    excluded_roles_ids=save_data["exclude"],
+                    muted_away=save_data.get("muted_away", []),
+                    timings=timings
                 ))
             else:
-                self.presences.append(await BotPresence.create(
+                self.presences.add(await BotPresence.create(
                     guild,
                     self
                 ))
+        except discord.HTTPException as error:  # don't let one broken guild stop the others
+            print(f"Couldn't set up {guild.name}: {error}")
+
+    async def _reconcile_loop(self):
+        # events can get lost (e.g. while reconnecting), so every now and then compare the actual mute states to ours
+        while True:
+            await asyncio.sleep(self.reconcile_interval)
+            for presence in self.presences:
+                presence.actor.post("reconcile", presence.reconcile)
+
+    async def _snapshot_loop(self):
+        while True:
+            await asyncio.sleep(self.snapshot_interval)
+            for presence in self.presences:
+                presence.actor.post("snapshot", presence.save)
 
     async def on_guild_join(self, guild):
-        self.presences.append(await BotPresence.create(
-            guild
-        ))
+        if not self.presences.by_guild(guild.id):
+            await self.create_presence(guild)  # also picks up the settings if we were in the guild before
 
     async def on_guild_remove(self, guild):
-        self.presences = [presence for presence in self.presences if presence.guild != guild]
+        presence = self.presences.remove(guild.id)
+        if presence:
+            presence.actor.close()
 
+    # Handlers don't run here: they're posted to the guild's actor, which runs them one at a time
     async def on_message(self, message):
-        if message.author == self.user:
+        metrics.count("events", "message")
+        if message.author == self.user or message.guild is None:
             return
-        for presence in self.presences:
-            await presence.on_message(message)  # NOTE: will receive messages from all guilds
+        if message.content in GLOBAL_COMMANDS:
+            presence = self.presences.by_guild(message.guild.id)
+            if presence:
+                presence.actor.post("message", presence.on_message, message)
+            return
+        session = self.presences.by_text_channel(message.channel.id)
+        if session:
+            session.presence.actor.post("message", session.on_message, message)
 
     async def on_voice_state_update(self, member, before, after):
+        metrics.count("events", "voice_state_update")
         if member == self.user:
             return
-        for presence in self.presences:
-            await presence.on_voice_state_update(member, before, after)  # NOTE: will receive updates from all guilds
+        # only sessions tracking the channel the member left and/or joined care, either about the move or about state changes inside it
+        before_session = self.presences.by_voice_channel(before.channel.id) if before.channel else None
+        after_session = self.presences.by_voice_channel(after.channel.id) if after.channel else None
+        if before_session:
+            before_session.presence.actor.post("voice_state_update", before_session.on_voice_state_update, member, before, after)
+        if after_session and after_session is not before_session:
+            after_session.presence.actor.post("voice_state_update", after_session.on_voice_state_update, member, before, after)
+        if after.channel and not after_session and not before_session:  # a session that sees them leave takes care of this itself
+            presence = self.presences.by_guild(member.guild.id)
+            if presence and member.id in presence.muted_away:
+                presence.actor.post("voice_state_update", presence.on_voice_state_update, member, before, after)
+
+    async def on_member_update(self, before, after):
+        presence = self.presences.by_guild(after.guild.id)
+        if presence:
+            presence.actor.post("member_update", presence.on_member_update, before, after)
+
+    async def on_member_remove(self, member):
+        presence = self.presences.by_guild(member.guild.id)
+        if presence:
+            presence.actor.post("member_remove", presence.on_member_remove, member)
+
+    async def on_guild_role_delete(self, role):
+        presence = self.presences.by_guild(role.guild.id)
+        if presence:
+            presence.actor.post("guild_role_delete", presence.on_guild_role_delete, role)
 
     async def on_raw_reaction_add(self, payload):
+        metrics.count("events", "raw_reaction_add")
         if payload.member == self.user:
             return
-        for presence in self.presences:
-            await presence.on_reaction_add(payload.emoji, payload.message_id, payload.member)  # NOTE: will receive reactions from all guilds
+        session = self.presences.by_panel(payload.message_id)
+        if session:
+            session.presence.actor.post("raw_reaction_add", session.on_reaction_add, payload.emoji, payload.message_id, payload.member)
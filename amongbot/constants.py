@@ -1 +1,3 @@
 SOURCE_CODE_URL = "https://gitlab.com/SeerLite/amongbot"
+GLOBAL_COMMANDS = ("among:help", "among:setup", "among:text", "among:assign")  # commands accepted outside of the dedicated text channel
+MESSAGE_LIMIT = 2000  # max characters in a Discord message
@@ -0,0 +1,193 @@
+"""Local control socket, for external programs (e.g. a screen scanner) that drive muting without going through Discord.
+
+Frames are a 4 byte big-endian length followed by that many bytes of UTF-8 JSON, both ways. Every request has an "op"
+and an "id", and gets exactly one reply with the same "id", in the order the requests were sent:
+
+    {"op": "bind", "id": 1, "token": "...", "voice": <voice channel id>}  must come first, picks the session to control
+    {"op": "mute", "id": 2, "mute": true}                                  sets global mute, toggles it without "mute"
+    {"op": "states", "id": 3, "members": {"<member id>": "dead", ...}}     "alive", "dead" or "ignored"
+    {"op": "ping", "id": 4}
+
+Replies have "ok", an "error" if it's false, and the time the request waited for the guild's actor and the time it took
+to handle, in microseconds ("queued_us", "handled_us"). Requests go through the guild's actor like gateway events.
+
+A connection has at most `max_in_flight` requests waiting for a reply. Once it's reached the server stops reading from
+the connection, so a client that sends faster than the bot keeps up gets slowed down by its socket.
+"""
+import asyncio
+import hmac
+import json
+import struct
+import time
+
+from .roster import MemberState
+from .metrics import metrics
+
+_HEADER = struct.Struct(">I")
+MAX_FRAME = 64 * 1024
+
+
+class ProtocolError(Exception):
+    pass
+
+
+async def read_frame(reader):
+    """Next message from a stream, or None once it's closed."""
+    try:
+        (length,) = _HEADER.unpack(await reader.readexactly(_HEADER.size))
+        if length > MAX_FRAME:
+            raise ProtocolError(f"frame of {length} bytes is over the limit of {MAX_FRAME}")
+        return json.loads(await reader.readexactly(length))
+    except asyncio.IncompleteReadError:
+        return None
+    except ValueError as error:  # also UnicodeDecodeError
+        raise ProtocolError(f"invalid JSON: {error}")
+
+
+def write_frame(writer, message):
+    data = json.dumps(message, separators=(",", ":")).encode()
+    writer.write(_HEADER.pack(len(data)) + data)
+
+
+class ControlServer:
+    def __init__(self, client, *, token, max_in_flight=64):
+        if not token:
+            raise ValueError("the control socket needs a token")
+        self.client = client
+        self.token = token
+        self.max_in_flight = max_in_flight
+        self._server = None
+
+        self.connections = 0
+        self.requests = 0
+
+    async def start(self, *, host="127.0.0.1", port=None, path=None):
+        """Listen on a TCP port on localhost, or on a Unix socket if `path` is given."""
+        if path:
+            self._server = await asyncio.start_unix_server(self._handle, path)
+            print(f"Control socket listening on {path}")
+        else:
+            self._server = await asyncio.start_server(self._handle, host, port)
+            print(f"Control socket listening on {host}:{self._server.sockets[0].getsockname()[1]}")
+
+    @property
+    def serving(self):
+        return self._server is not None
+
+    @property
+    def port(self):
+        return self._server.sockets[0].getsockname()[1] if self._server else None
+
+    def close(self):
+        if self._server:
+            self._server.close()
+            self._server = None
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        in_flight = asyncio.Semaphore(self.max_in_flight)
+        session = None
+        try:
+            while True:
+                await in_flight.acquire()
+                await writer.drain()  # don't queue more replies than the client reads
+                request = await read_frame(reader)
+                if request is None:
+                    break
+                self.requests += 1
+                request_id = request.get("id") if isinstance(request, dict) else None
+
+                if session is None:
+                    session = self._bind(request)
+                    if session is None:
+                        write_frame(writer, {"id": request_id, "ok": False, "error": "first request must bind to a session with a valid token"})
+                        break
+                    write_frame(writer, {"id": request_id, "ok": True, "guild": session.guild.id, "voice": session.voice_channel.id})
+                    in_flight.release()
+                    continue
+
+                try:
+                    handler, args = self._parse(request)
+                except (ProtocolError, AttributeError, KeyError, TypeError, ValueError) as error:
+                    write_frame(writer, {"id": request_id, "ok": False, "error": f"bad request: {error}"})
+                    in_flight.release()
+                    continue
+                metrics.count("control_requests", request["op"], session.guild.id)
+                self._dispatch(session, handler, args, request_id, writer, in_flight)
+        except ProtocolError as error:
+            write_frame(writer, {"id": None, "ok": False, "error": str(error)})
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def _bind(self, request):
+        if not isinstance(request, dict) or request.get("op") != "bind":
+            return None
+        if not hmac.compare_digest(str(request.get("token", "")).encode(), self.token.encode()):
+            return None
+        try:
+            return self.client.presences.by_voice_channel(int(request["voice"]))
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def _parse(self, request):
+        op = request["op"]
+        if op == "ping":
+            return None, ()
+        if op == "mute":
+            mute = request.get("mute")
+            if mute is not None and not isinstance(mute, bool):
+                raise ProtocolError("mute must be true, false or missing")
+            return _set_muting, (mute,)
+        if op == "states":
+            return _set_states, ({int(member_id): MemberState(state) for member_id, state in request["members"].items()},)
+        raise ProtocolError(f"unknown op {op!r}")
+
+    def _dispatch(self, session, handler, args, request_id, writer, in_flight):
+        received = time.perf_counter()
+
+        def reply(message):
+            message["id"] = request_id
+            if not writer.is_closing():
+                write_frame(writer, message)
+            in_flight.release()
+
+        if handler is None:  # ping
+            reply({"ok": True, "queued_us": 0, "handled_us": 0})
+            return
+
+        async def run():
+            started = time.perf_counter()
+            if session not in session.presence.sessions:
+                reply({"ok": False, "error": "session is gone"})
+                return
+            try:
+                result = await handler(session, *args)
+            except Exception as error:
+                reply({"ok": False, "error": str(error)})
+                raise
+            finished = time.perf_counter()
+            reply({"ok": True, "queued_us": round((started - received) * 1e6), "handled_us": round((finished - started) * 1e6), **result})
+        session.presence.actor.post("control", run)
+
+
+async def _set_muting(session, mute):
+    mute = not session.muting if mute is None else mute
+    await session.set_muting(mute)
+    await session.control_panel.update()
+    session.last_mute_time = time.monotonic()
+    return {"muting": mute}
+
+
+async def _set_states(session, states):
+    unknown = []
+    for member_id, state in states.items():
+        tracked_member = session.roster.get(member_id)
+        if tracked_member:
+            session.roster.set_state(tracked_member, state)
+        else:
+            unknown.append(member_id)
+    await session.set_muting(session.muting)
+    await session.control_panel.update()
+    return {"unknown": unknown}
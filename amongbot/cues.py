@@ -0,0 +1,152 @@
+"""Audio cues played in the tracked voice channel when muting and unmuting.
+
+Cue files are decoded with ffmpeg and Opus-encoded once, the first time they're seen, into an on-disk cache keyed by the
+file's hash. At startup the cached frames are read into memory, and playback sends them to the voice connection as they
+are: no ffmpeg process or encoding per cue.
+"""
+import asyncio
+import hashlib
+import os
+import struct
+import subprocess
+
+import discord
+
+CUE_NAMES = ("mute", "unmute")
+_FORMAT_VERSION = b"1"  # part of the cache key, bump when the cache format or encoder settings change
+_LENGTH = struct.Struct("<H")
+
+
+class CueSource(discord.AudioSource):
+    """Plays already encoded Opus frames."""
+
+    def __init__(self, frames):
+        self._frames = iter(frames)
+
+    def read(self):
+        return next(self._frames, b"")
+
+    def is_opus(self):
+        return True
+
+
+class CueCache:
+    """Opus frames of every cue, shared by all guilds.
+
+    Looks for `<name>.<any extension>` files in `path` for each name in CUE_NAMES. Cues without a file are skipped.
+    """
+
+    def __init__(self, path="cues", cache_path=os.path.join(".cache", "cues")):
+        self.path = path
+        self.cache_path = cache_path
+        self.frames = {}  # cue name -> tuple of Opus frames
+
+    def __contains__(self, name):
+        return name in self.frames
+
+    def __bool__(self):
+        return bool(self.frames)
+
+    async def load(self):
+        await asyncio.get_running_loop().run_in_executor(None, self._load)
+
+    def _load(self):
+        if not os.path.isdir(self.path):
+            return
+        for file_name in sorted(os.listdir(self.path)):
+            name = os.path.splitext(file_name)[0]
+            if name not in CUE_NAMES or name in self.frames:
+                continue
+            try:
+                self.frames[name] = self._load_file(os.path.join(self.path, file_name))
+            except discord.opus.OpusNotLoaded:
+                print("Couldn't load cues: libopus isn't installed.")
+                return
+            except (OSError, subprocess.CalledProcessError) as error:
+                print(f"Couldn't load the {name} cue from {file_name}: {error}")
+
+    def _load_file(self, file_path):
+        with open(file_path, "rb") as cue_file:
+            digest = hashlib.sha256(_FORMAT_VERSION + cue_file.read()).hexdigest()
+        cached_path = os.path.join(self.cache_path, digest + ".opus")
+        if not os.path.exists(cached_path):
+            self._encode(file_path, cached_path)
+
+        frames = []
+        with open(cached_path, "rb") as cached_file:
+            data = cached_file.read()
+        offset = 0
+        while offset < len(data):
+            (length,) = _LENGTH.unpack_from(data, offset)
+            offset += _LENGTH.size
+            frames.append(data[offset:offset + length])
+            offset += length
+        return tuple(frames)
+
+    def _encode(self, file_path, cached_path):
+        encoder = discord.opus.Encoder()
+        pcm = subprocess.run(
+            ["ffmpeg", "-loglevel", "error", "-i", file_path, "-f", "s16le", "-ar", str(encoder.SAMPLING_RATE), "-ac", str(encoder.CHANNELS), "pipe:1"],
+            stdin=subprocess.DEVNULL, capture_output=True, check=True
+        ).stdout
+
+        os.makedirs(self.cache_path, exist_ok=True)
+        temp_path = cached_path + ".tmp"
+        with open(temp_path, "wb") as cached_file:
+            for start in range(0, len(pcm), encoder.FRAME_SIZE):
+                frame = pcm[start:start + encoder.FRAME_SIZE].ljust(encoder.FRAME_SIZE, b"\0")  # pad the last frame with silence
+                packet = encoder.encode(frame, encoder.SAMPLES_PER_FRAME)
+                cached_file.write(_LENGTH.pack(len(packet)) + packet)
+        os.replace(temp_path, cached_path)
+
+
+class GuildVoice:
+    """The bot's voice connection in one guild.
+
+    Discord allows one voice connection per guild, so sessions share it: it stays in the channel of the session that
+    connected it until that session disconnects it.
+    """
+
+    def __init__(self, guild, cues):
+        self.guild = guild
+        self.cues = cues
+        self.session = None  # session whose channel we're connected to
+        self.voice_client = None
+
+    @property
+    def connected(self):
+        return self.voice_client is not None and self.voice_client.is_connected()
+
+    async def connect(self, session):
+        """Connect to the session's voice channel, reusing the connection if there is one already."""
+        self.session = session  # right away, so a toggle while connecting sees it
+        try:
+            if self.connected:
+                if self.voice_client.channel != session.voice_channel:
+                    await self.voice_client.move_to(session.voice_channel)
+            else:
+                voice_client = await session.voice_channel.connect(self_deaf=True)
+                if self.session is not session:  # disconnected while connecting
+                    await voice_client.disconnect(force=True)
+                    return
+                self.voice_client = voice_client
+        except BaseException:
+            if self.session is session:
+                self.session = None
+            raise
+
+    async def disconnect(self, *, force=False):
+        try:
+            if self.voice_client:
+                await self.voice_client.disconnect(force=force)
+        finally:
+            self.voice_client = None
+            self.session = None
+
+    def play(self, session, name):
+        """Start playing a cue in the session's channel, if we're connected there. Doesn't wait for it to finish."""
+        if session is not self.session or not self.connected or name not in self.cues:
+            return
+        if self.voice_client.is_playing():
+            self.voice_client.stop()  # a newer toggle wins
+        self.voice_client.play(CueSource(self.cues.frames[name]))
@@ -9,3 +9,21 @@ class SameValueError(AmongBotException):
 
     def __str__(self):
         return self.value
+
+
+class ChannelTakenError(AmongBotException):
+    """Raised when a channel is already used by another session"""
+    def __init__(self, channel=None):
+        self.channel = channel
+
+    def __str__(self):
+        return str(self.channel)
+
+
+class StoreLockedError(AmongBotException):
+    """Raised when another process holds a lock in the guild store"""
+    def __init__(self, name=None):
+        self.name = name
+
+    def __str__(self):
+        return f"{self.name} is locked by another process"
@@ -0,0 +1,50 @@
+class ExclusionCache:
+    """Ids of the guild members that have any of the excluded roles, so checking a member is a single set lookup.
+
+    Keep it up to date by calling update_member() when a member's roles change and remove_role() when a role is deleted.
+    """
+
+    check_consistency = False  # compare every lookup against the members' actual roles, for tests
+
+    def __init__(self, roles=()):
+        self.roles = frozenset()
+        self._member_ids = set()
+        self.set_roles(roles)
+
+    def __contains__(self, member):
+        excluded = member.id in self._member_ids
+        if self.check_consistency:
+            actual = any(role in self.roles for role in member.roles)
+            assert excluded == actual, f"exclusion cache says {excluded} for {member}, roles say {actual}"
+        return excluded
+
+    @property
+    def member_ids(self):
+        return frozenset(self._member_ids)
+
+    def set_roles(self, roles):
+        roles = frozenset(role for role in roles if role is not None)  # None for roles deleted while we were offline
+        for role in roles.difference(self.roles):
+            self._member_ids.update(member.id for member in role.members)
+        removed = self.roles.difference(roles)
+        self.roles = roles
+        for role in removed:
+            for member in role.members:
+                self.update_member(member)
+
+    def update_member(self, member):
+        if any(role in self.roles for role in member.roles):
+            self._member_ids.add(member.id)
+        else:
+            self._member_ids.discard(member.id)
+
+    def remove_member(self, member_id):
+        self._member_ids.discard(member_id)
+
+    def remove_role(self, role):
+        if role not in self.roles:
+            return
+        members = role.members  # still works after deletion, members keep the role id until their next update
+        self.roles = self.roles.difference((role,))
+        for member in members:
+            self.update_member(member)
@@ -0,0 +1,29 @@
+import time
+
+
+class GestureRecognizer:
+    """Recognizes the mimic gesture: a deafen followed by an undeafen within `max_hold` seconds.
+
+    Keeps track of every mimicked member separately, so several members can mimic at once. Only looks at the deafen and
+    undeafen edges, with monotonic timestamps.
+    """
+
+    def __init__(self, *, max_hold=1, clock=time.monotonic):
+        self.max_hold = max_hold
+        self.clock = clock
+        self._deafened_at = {}  # member id -> when they deafened, for members in the middle of a gesture
+
+    def __contains__(self, member_id):
+        return member_id in self._deafened_at
+
+    def deafen(self, member_id):
+        self._deafened_at[member_id] = self.clock()
+
+    def undeafen(self, member_id):
+        """Returns True if this undeafen completes a gesture."""
+        deafened_at = self._deafened_at.pop(member_id, None)
+        return deafened_at is not None and self.clock() - deafened_at <= self.max_hold
+
+    def cancel(self, member_id):
+        """Forget a gesture in progress. Returns True if there was one."""
+        return self._deafened_at.pop(member_id, None) is not None
@@ -0,0 +1,210 @@
+import asyncio
+import bisect
+import collections
+import contextlib
+import time
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # seconds
+
+
+class Histogram:
+    __slots__ = ("counts", "count", "sum", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # last one is +Inf
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.count += other.count
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    def copy(self):
+        histogram = Histogram()
+        histogram.merge(self)
+        return histogram
+
+    def quantile(self, q):
+        """Upper bound of the bucket the q-quantile falls in."""
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS + (self.max,), self.counts):
+            seen += count
+            if seen >= target:
+                return min(bound, self.max)
+        return self.max
+
+
+class _Timer:
+    __slots__ = ("metrics", "name", "label", "guild_id", "start")
+
+    def __init__(self, metrics, name, label, guild_id):
+        self.metrics = metrics
+        self.name = name
+        self.label = label
+        self.guild_id = guild_id
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.name, time.perf_counter() - self.start, self.label, self.guild_id)
+
+
+_disabled_timer = contextlib.nullcontext()
+
+
+class Metrics:
+    """Counters, gauges and latency histograms, per guild and global.
+
+    Every metric has a name and a label (e.g. "api_seconds", "member.edit"). When disabled, every method returns right
+    away, so the instrumentation can stay in place.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.counters = collections.defaultdict(int)  # (name, label, guild id or None for global) -> value
+        self.histograms = collections.defaultdict(Histogram)  # same keys
+        self.gauges = {}  # same keys
+        self._server = None
+
+    def count(self, name, label="", guild_id=None, value=1):
+        if not self.enabled:
+            return
+        self.counters[(name, label, None)] += value
+        if guild_id is not None:
+            self.counters[(name, label, guild_id)] += value
+
+    def observe(self, name, seconds, label="", guild_id=None):
+        if not self.enabled:
+            return
+        self.histograms[(name, label, None)].observe(seconds)
+        if guild_id is not None:
+            self.histograms[(name, label, guild_id)].observe(seconds)
+
+    def set(self, name, value, label="", guild_id=None):
+        if not self.enabled:
+            return
+        self.gauges[(name, label, guild_id)] = value
+
+    def snapshot(self):
+        """Everything recorded so far, picklable, for merge() in another process."""
+        return {"counters": dict(self.counters), "histograms": {key: histogram.copy() for key, histogram in self.histograms.items()}, "gauges": dict(self.gauges)}
+
+    def merge(self, snapshot):
+        """Add up another process's snapshot() with ours. Gauges are replaced, not added."""
+        for key, value in snapshot["counters"].items():
+            self.counters[key] += value
+        for key, histogram in snapshot["histograms"].items():
+            self.histograms[key].merge(histogram)
+        self.gauges.update(snapshot["gauges"])
+
+    def clear(self):
+        self.counters.clear()
+        self.histograms.clear()
+        self.gauges.clear()
+
+    def timed(self, name, label="", guild_id=None):
+        """Context manager that observes how long its block took."""
+        if not self.enabled:
+            return _disabled_timer
+        return _Timer(self, name, label, guild_id)
+
+    def prometheus(self):
+        """The global metrics in the Prometheus text exposition format. Per guild ones are only for among:stats, thousands
+        of guilds would make thousands of series."""
+        lines = []
+        typed = set()
+
+        def family(metric, kind):
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} {kind}")
+
+        for (name, label, guild_id), value in sorted(self.counters.items(), key=_sort_key):
+            if guild_id is None:
+                family(f"amongbot_{name}_total", "counter")
+                lines.append(f"amongbot_{name}_total{_labels(label)} {value}")
+        for (name, label, guild_id), value in sorted(self.gauges.items(), key=_sort_key):
+            if guild_id is None:
+                family(f"amongbot_{name}", "gauge")
+                lines.append(f"amongbot_{name}{_labels(label)} {value}")
+        for (name, label, guild_id), histogram in sorted(self.histograms.items(), key=_sort_key):
+            if guild_id is not None:
+                continue
+            family(f"amongbot_{name}", "histogram")
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ("+Inf",), histogram.counts):
+                cumulative += count
+                lines.append(f"amongbot_{name}_bucket{_labels(label, le=bound)} {cumulative}")
+            lines.append(f"amongbot_{name}_sum{_labels(label)} {histogram.sum}")
+            lines.append(f"amongbot_{name}_count{_labels(label)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def guild_summary(self, guild_id):
+        """Human readable numbers for one guild, for among:stats."""
+        lines = []
+        for (name, label, id), value in sorted(self.counters.items(), key=_sort_key):
+            if id == guild_id:
+                lines.append(f"{name}{'.' + label if label else ''} : {value}")
+        for (name, label, id), histogram in sorted(self.histograms.items(), key=_sort_key):
+            if id == guild_id and histogram.count:
+                lines.append(f"{name}{'.' + label if label else ''} : n={histogram.count} "
+                             f"avg={histogram.sum / histogram.count * 1000:.0f}ms "
+                             f"p50<={histogram.quantile(0.5) * 1000:.0f}ms "
+                             f"p99<={histogram.quantile(0.99) * 1000:.0f}ms "
+                             f"max={histogram.max * 1000:.0f}ms")
+        return "\n".join(lines)
+
+    @property
+    def serving(self):
+        return self._server is not None
+
+    async def serve(self, host="127.0.0.1", port=9477):
+        """Serve prometheus() over plain HTTP, for scraping."""
+        async def handle(reader, writer):
+            try:
+                await reader.readuntil(b"\r\n\r\n")
+                body = self.prometheus().encode()
+                writer.write(b"HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                             b"Content-Length: " + str(len(body)).encode() + b"\r\n\r\n" + body)
+                await writer.drain()
+            except (asyncio.IncompleteReadError, ConnectionError):
+                pass
+            finally:
+                writer.close()
+
+        self._server = await asyncio.start_server(handle, host, port)
+        print(f"Serving metrics on http://{host}:{port}/")
+
+    def close(self):
+        if self._server:
+            self._server.close()
+            self._server = None
+
+
+def _sort_key(item):
+    name, label, guild_id = item[0]
+    return (name, label, guild_id or 0)
+
+
+def _labels(label, **extra):
+    pairs = []
+    if label:
+        pairs.append(f'label="{label}"')
+    pairs.extend(f'{name}="{value}"' for name, value in extra.items())
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+metrics = Metrics()  # the instance everything reports to, enabled by the client
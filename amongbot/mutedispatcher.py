@@ -0,0 +1,193 @@
+import asyncio
+import collections
+import time
+
+import discord
+
+from .metrics import metrics
+
+
+class RateLimiter:
+    """Allows `rate` calls per `per` seconds window, like Discord's buckets that reset all at once."""
+
+    def __init__(self, rate, per):
+        self.rate = rate
+        self.per = per
+        self._remaining = rate
+        self._reset = 0
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            if now >= self._reset:
+                self._remaining = self.rate
+                self._reset = now + self.per
+            if self._remaining > 0:
+                self._remaining -= 1
+                return
+            await asyncio.sleep(self._reset - now)
+
+
+class MuteDispatcher:
+    """Queues server mute edits for one guild and sends them within the guild's member edit rate limit.
+
+    Only the latest requested state of a member is kept: requesting a new state replaces a pending one, and requesting
+    the state the member is already in cancels it. Each member has at most one edit in flight.
+
+    The cached voice state only changes once the edit's gateway event arrives, which can be after the edit returned.
+    Until then the last value sent is what the member is in, not the cache.
+    """
+
+    def __init__(self, guild, *, rate=10, per=10, max_retries=3, retry_delay=0.5, echo_timeout=5):
+        self.guild = guild
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.echo_timeout = echo_timeout  # seconds to wait for an edit's voice state update before trusting the cache again
+
+        self._bucket = RateLimiter(rate, per)
+        self._pending = {}  # member id -> (tracked member, mute), in request order
+        self._in_flight = {}  # member id -> mute currently being sent
+        self._unechoed = {}  # member id -> ([mute values sent, oldest first], when the last one was sent) until their voice state updates arrive
+        self._tasks = set()
+        self._wakeup = asyncio.Event()
+        self._worker = None
+        self._released = asyncio.Event()  # cleared while held
+        self._released.set()
+
+        self._toggle_start = None
+        self.last_toggle_time = None  # seconds from the last toggle until every edit it caused was done
+        self.toggle_times = collections.deque(maxlen=100)
+
+    def expected_mute(self, member_id):
+        """Mute state we're about to set on a member, or None if we're not touching it."""
+        if member_id in self._pending:
+            return self._pending[member_id][1]
+        if member_id in self._in_flight:
+            return self._in_flight[member_id]
+        sent = self._sent(member_id)
+        return sent[-1] if sent else None
+
+    def echoed(self, member_id, mute):
+        """Call with a member's new mute state from a voice state update. Returns True if it came from one of our edits."""
+        sent = self._sent(member_id)
+        if not sent or mute not in sent:
+            return False
+        del sent[:sent.index(mute) + 1]
+        if not sent:
+            del self._unechoed[member_id]
+        return True
+
+    def _sent(self, member_id):
+        """Mute values sent to a member whose voice state updates haven't arrived yet."""
+        if member_id not in self._unechoed:
+            return None
+        sent, sent_at = self._unechoed[member_id]
+        if time.monotonic() - sent_at > self.echo_timeout:  # lost, e.g. while reconnecting
+            del self._unechoed[member_id]
+            return None
+        return sent
+
+    def cancel(self, member_id):
+        """Drop a member's edit that wasn't sent yet, e.g. because they left voice and it would fail."""
+        self._pending.pop(member_id, None)
+
+    @property
+    def busy(self):
+        return bool(self._pending or self._in_flight)
+
+    def hold(self):
+        """Keep requests queued without sending them until release(), so they can still be replaced or cancelled."""
+        self._released.clear()
+
+    def release(self):
+        self._released.set()
+
+    def begin_toggle(self):
+        self._toggle_start = time.perf_counter()
+        self._check_toggle()  # in case the toggle didn't need any edits
+
+    def request(self, tracked_member, mute):
+        member_id = tracked_member.id
+        sent = self._sent(member_id)
+        if member_id in self._in_flight:
+            current = self._in_flight[member_id]
+        elif sent:  # the cache is behind
+            current = sent[-1]
+        else:
+            member = tracked_member.member
+            current = member.voice.mute if member and member.voice else tracked_member.mute
+
+        if current == mute:
+            self._pending.pop(member_id, None)  # cancels anything not sent yet
+            return
+
+        self._pending.pop(member_id, None)  # re-insert so it's ordered by latest request
+        self._pending[member_id] = (tracked_member, mute)
+        self._wakeup.set()
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while self._pending:
+            await self._released.wait()
+            member_id = next((id for id in self._pending if id not in self._in_flight), None)
+            if member_id is None:  # everything pending waits for an edit of the same member
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            await self._bucket.acquire()
+            await self._released.wait()  # might have been held again while waiting for the bucket
+            if member_id not in self._pending or member_id in self._in_flight:  # cancelled or superseded while waiting
+                continue
+            tracked_member, mute = self._pending.pop(member_id)
+            self._in_flight[member_id] = mute
+            task = asyncio.create_task(self._send(tracked_member, mute))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, tracked_member, mute):
+        try:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    member = tracked_member.member
+                    if member is None:  # not in voice anymore, nothing to edit
+                        return
+                    metrics.count("api_calls", "member.edit", self.guild.id)
+                    # the voice state update can even come before the response
+                    sent, _ = self._unechoed.get(tracked_member.id, ([], None))
+                    sent.append(mute)
+                    self._unechoed[tracked_member.id] = (sent, time.monotonic())
+                    try:
+                        with metrics.timed("api_seconds", "member.edit", self.guild.id):
+                            await member.edit(mute=mute)
+                    except discord.HTTPException:
+                        self._forget_sent(tracked_member.id, mute)
+                        raise
+                    tracked_member._mute = mute  # only once the server has it, so it can't drift
+                    return
+                except discord.HTTPException as error:
+                    transient = error.status == 429 or error.status >= 500
+                    metrics.count("api_errors", str(error.status), self.guild.id)
+                    if not transient or attempt == self.max_retries:
+                        print(f"Couldn't {'mute' if mute else 'unmute'} {tracked_member.display_name} in {self.guild.name}: {error}")
+                        return
+                    await asyncio.sleep(self.retry_delay * 2 ** attempt)
+        finally:
+            del self._in_flight[tracked_member.id]
+            self._wakeup.set()
+            self._check_toggle()
+
+    def _forget_sent(self, member_id, mute):
+        sent, sent_at = self._unechoed.get(member_id, ([], None))
+        if mute in sent:
+            del sent[len(sent) - 1 - sent[::-1].index(mute)]  # the last one, the edit that failed
+        if not sent:
+            self._unechoed.pop(member_id, None)
+
+    def _check_toggle(self):
+        if self._toggle_start is not None and not self.busy:
+            self.last_toggle_time = time.perf_counter() - self._toggle_start
+            self.toggle_times.append(self.last_toggle_time)
+            metrics.observe("toggle_seconds", self.last_toggle_time, guild_id=self.guild.id)
+            self._toggle_start = None
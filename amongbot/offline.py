@@ -0,0 +1,488 @@
+"""Offline stand-in for the parts of discord.py the bot touches, for benchmarks and local testing.
+
+Guilds, channels, members, messages and reactions live in memory. Every REST call goes through a FakeAPI that adds
+latency, counts calls per route and applies per-route rate limit buckets. Gateway events are dispatched to the real
+Client handlers as tasks, the way discord.py does it.
+"""
+import asyncio
+import collections
+import hashlib
+import itertools
+import random
+import time
+from types import SimpleNamespace
+
+import discord
+
+from .client import Client
+
+_ids = itertools.count(1000)
+
+
+def new_id():
+    # Like a snowflake: the creation "time" in the high bits decides the shard, (id >> 22) % shard count. It's a hash of
+    # the counter so guilds spread over shards, and the same in every process that creates things in the same order.
+    n = next(_ids)
+    time_bits = int.from_bytes(hashlib.blake2b(n.to_bytes(8, "little"), digest_size=4).digest(), "little")
+    return time_bits << 22 | n
+
+
+class FakeAPI:
+    """Simulated REST API: latency, call counters and rate limit buckets.
+
+    `buckets` maps a route name to (limit, per seconds). A call over the limit counts as a 429 and then either waits for
+    the bucket to reset, like discord.py does, or raises discord.HTTPException if `raise_429` is set.
+    """
+
+    def __init__(self, *, latency=0.05, jitter=0.02, buckets=None, raise_429=False, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.buckets = buckets if buckets is not None else {
+            "member.edit": (10, 10),  # per guild
+            "message.edit": (5, 5),   # per channel
+            "reaction": (1, 0.25),    # per channel
+        }
+        self.raise_429 = raise_429
+        self.random = random.Random(seed)
+
+        self.calls = collections.Counter()
+        self.rate_limited = collections.Counter()
+        self._windows = {}  # (route, key) -> (window start, calls in window)
+
+    async def call(self, route, key=None):
+        self.calls[route] += 1
+        bucket = self.buckets.get(route)
+        if bucket:
+            limit, per = bucket
+            while True:
+                now = time.monotonic()
+                start, count = self._windows.get((route, key), (now, 0))
+                if now - start >= per:
+                    start, count = now, 0
+                if count < limit:
+                    self._windows[(route, key)] = (start, count + 1)
+                    break
+                self.rate_limited[route] += 1
+                if self.raise_429:
+                    raise discord.HTTPException(SimpleNamespace(status=429, reason="Too Many Requests"), "You are being rate limited.")
+                await asyncio.sleep(start + per - now)
+        await asyncio.sleep(max(0, self.latency + self.random.uniform(-self.jitter, self.jitter)))
+
+
+class FakeRole:
+    def __init__(self, guild, name):
+        self.id = new_id()
+        self.guild = guild
+        self.name = name
+        self.mention = f"<@&{self.id}>"
+
+    @property
+    def members(self):
+        return [member for member in self.guild.members if self in member.roles]
+
+
+class FakeVoiceState:
+    def __init__(self, channel=None, *, mute=False, deaf=False, self_mute=False, self_deaf=False):
+        self.channel = channel
+        self.mute = mute
+        self.deaf = deaf
+        self.self_mute = self_mute
+        self.self_deaf = self_deaf
+
+    def copy(self, **changes):
+        state = FakeVoiceState(self.channel, mute=self.mute, deaf=self.deaf, self_mute=self.self_mute, self_deaf=self.self_deaf)
+        for name, value in changes.items():
+            setattr(state, name, value)
+        return state
+
+
+class FakeMember:
+    def __init__(self, guild, name, *, roles=(), bot=False):
+        self.id = new_id()
+        self.guild = guild
+        self.name = name
+        self.display_name = name
+        self.mention = f"<@{self.id}>"
+        self.bot = bot
+        self.roles = list(roles)
+        self.voice = None
+        self._server_mute = False  # server mutes stick to the member, not the channel
+
+    def __str__(self):
+        return self.name
+
+    def _set_voice(self, *, lost=False, **changes):
+        before = self.voice or FakeVoiceState(mute=self._server_mute)
+        after = before.copy(**changes)
+        self._server_mute = after.mute
+        self.voice = after if after.channel else None
+        if not lost:
+            self.guild.gateway.dispatch("voice_state_update", self, before, after)
+
+    # gateway side: things the user does
+    def join(self, channel):
+        self._set_voice(channel=channel)
+
+    def leave(self):
+        self._set_voice(channel=None, self_deaf=False)
+
+    def deafen(self, self_deaf=True):
+        self._set_voice(self_deaf=self_deaf)
+
+    def drift(self, **changes):
+        """Change the voice state without the gateway event, like one missed while reconnecting."""
+        self._set_voice(lost=True, **changes)
+
+    def set_roles(self, roles):
+        before = SimpleNamespace(id=self.id, display_name=self.display_name, roles=list(self.roles))
+        self.roles = list(roles)
+        self.guild.gateway.dispatch("member_update", before, self)
+
+    # REST side: things the bot does
+    async def edit(self, *, mute=None):
+        await self.guild.api.call("member.edit", self.guild.id)
+        if mute is not None:
+            if self.voice is None:
+                raise discord.HTTPException(SimpleNamespace(status=400, reason="Bad Request"), "Target user is not connected to voice.")
+            echo_delay = self.guild.gateway.echo_delay
+            if echo_delay:  # the cached voice state only changes once the gateway event arrives
+                self._server_mute = mute
+                asyncio.get_running_loop().call_later(echo_delay, self._echo, mute)
+            else:
+                self._echo(mute)
+
+    def _echo(self, mute):
+        if self.voice:
+            self._set_voice(mute=mute)
+        self.guild.state_changed()
+
+
+class FakeReaction:
+    def __init__(self, message, emoji):
+        self.message = message
+        self.emoji = emoji
+        self._users = []
+
+    @property
+    def count(self):
+        return len(self._users)
+
+    @property
+    def me(self):
+        return self.message.guild.me in self._users
+
+    async def users(self):
+        await self.message.guild.api.call("reaction.users", self.message.channel.id)
+        for user in list(self._users):
+            yield user
+
+    async def clear(self):
+        await self.message.guild.api.call("reaction", self.message.channel.id)
+        self.message.reactions.remove(self)
+
+
+class FakeMessage:
+    def __init__(self, channel, author, content):
+        self.id = new_id()
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.content = content
+        self.reactions = []
+        self.role_mentions = []
+
+    def _reaction(self, emoji):
+        for reaction in self.reactions:
+            if reaction.emoji == emoji:
+                return reaction
+        reaction = FakeReaction(self, emoji)
+        self.reactions.append(reaction)
+        return reaction
+
+    async def edit(self, *, content):
+        await self.guild.api.call("message.edit", self.channel.id)
+        self.content = content
+
+    async def delete(self):
+        await self.guild.api.call("message.delete", self.channel.id)
+        self.channel.messages.pop(self.id, None)
+
+    async def add_reaction(self, emoji):
+        await self.guild.api.call("reaction", self.channel.id)
+        reaction = self._reaction(emoji)
+        if self.guild.me not in reaction._users:
+            reaction._users.append(self.guild.me)
+
+    async def remove_reaction(self, emoji, member):
+        await self.guild.api.call("reaction", self.channel.id)
+        emoji = getattr(emoji, "name", emoji)
+        reaction = self._reaction(emoji)
+        if member in reaction._users:
+            reaction._users.remove(member)
+
+    async def clear_reactions(self):
+        await self.guild.api.call("reaction", self.channel.id)
+        self.reactions = []
+
+    # gateway side
+    def click(self, emoji, member):
+        self._reaction(emoji)._users.append(member)
+        payload = SimpleNamespace(message_id=self.id, channel_id=self.channel.id, guild_id=self.guild.id, user_id=member.id, member=member, emoji=SimpleNamespace(name=emoji))
+        self.guild.gateway.dispatch("raw_reaction_add", payload)
+
+
+class FakeTextChannel:
+    def __init__(self, guild, name):
+        self.id = new_id()
+        self.guild = guild
+        self.name = name
+        self.mention = f"<#{self.id}>"
+        self.messages = {}
+
+    async def send(self, content):
+        await self.guild.api.call("message.send", self.id)
+        message = FakeMessage(self, self.guild.me, content)
+        self.messages[message.id] = message
+        return message
+
+    async def fetch_message(self, id):
+        await self.guild.api.call("message.fetch", self.id)
+        try:
+            return self.messages[id]
+        except KeyError:
+            raise discord.NotFound(SimpleNamespace(status=404, reason="Not Found"), "Unknown Message")
+
+    # gateway side
+    def post(self, author, content, *, role_mentions=()):
+        message = FakeMessage(self, author, content)
+        message.role_mentions = list(role_mentions)
+        self.messages[message.id] = message
+        self.guild.gateway.dispatch("message", message)
+        return message
+
+
+class FakeVoiceClient:
+    """Voice connection that consumes an AudioSource at Discord's pace of one 20ms frame at a time."""
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.frames_sent = 0
+        self.plays = 0
+        self._connected = True
+        self._player = None
+
+    def is_connected(self):
+        return self._connected
+
+    def is_playing(self):
+        return self._player is not None and not self._player.done()
+
+    async def move_to(self, channel):
+        await self.channel.guild.api.call("voice.connect", self.channel.guild.id)
+        self.channel = channel
+
+    async def disconnect(self, *, force=False):
+        self.stop()
+        self._connected = False
+
+    def stop(self):
+        if self._player:
+            self._player.cancel()
+            self._player = None
+
+    def play(self, source):
+        self.plays += 1
+
+        async def player():
+            while source.read():
+                self.frames_sent += 1
+                await asyncio.sleep(0.02)
+        self._player = asyncio.create_task(player())
+
+
+class FakeVoiceChannel:
+    def __init__(self, guild, name):
+        self.id = new_id()
+        self.guild = guild
+        self.name = name
+        self.mention = f"<#{self.id}>"
+
+    async def connect(self, *, self_deaf=False):
+        await self.guild.api.call("voice.connect", self.guild.id)
+        return FakeVoiceClient(self)
+
+    @property
+    def members(self):
+        return [member for member in self.guild.members if member.voice and member.voice.channel is self]
+
+
+class FakeGuild:
+    def __init__(self, gateway, api, name, me):
+        self.id = new_id()
+        self.gateway = gateway
+        self.api = api
+        self.name = name
+        self.me = me
+        self._members = {}  # every member the gateway knows of, cached or not
+        self.idle_members = 0  # members that never do anything, only created if the client caches every member
+        self.roles = []
+        self.channels = {}
+        self._state_changed = asyncio.Event()
+
+    def add_text_channel(self, name="among-bot"):
+        channel = FakeTextChannel(self, name)
+        self.channels[channel.id] = channel
+        return channel
+
+    def add_voice_channel(self, name="Among Us"):
+        channel = FakeVoiceChannel(self, name)
+        self.channels[channel.id] = channel
+        return channel
+
+    def add_member(self, name, **kwargs):
+        member = FakeMember(self, name, **kwargs)
+        self._members[member.id] = member
+        return member
+
+    def add_idle_members(self, count):
+        """Members that stay out of voice channels, for memory benchmarks. Created in chunk()."""
+        self.idle_members += count
+
+    def chunk(self):
+        """What chunking at startup does: fetch every member into the cache, if the client caches every member."""
+        if self.gateway.cache_all_members:
+            for n in range(self.idle_members):
+                self.add_member(f"idle{n}")
+            self.idle_members = 0
+
+    @property
+    def member_count(self):
+        return len(self._members) + self.idle_members
+
+    @property
+    def members(self):
+        """Members in the client's member cache."""
+        return [member for member in self._members.values() if self._cached(member)]
+
+    def _cached(self, member):
+        return self.gateway.cache_all_members or member.voice is not None
+
+    def add_role(self, name):
+        role = FakeRole(self, name)
+        self.roles.append(role)
+        return role
+
+    def delete_role(self, role):
+        self.roles.remove(role)  # members keep it until their next update, like discord.py's cached members
+        self.gateway.dispatch("guild_role_delete", role)
+
+    def get_channel(self, id):
+        return self.channels.get(id)
+
+    def get_role(self, id):
+        for role in self.roles:
+            if role.id == id:
+                return role
+        return None
+
+    def get_member(self, id):
+        member = self._members.get(id)
+        return member if member and self._cached(member) else None
+
+    def state_changed(self):
+        self._state_changed.set()
+
+    async def wait_until(self, predicate, timeout=30):
+        """Wait until predicate() is true, checking again whenever a member's voice state is edited."""
+        async def wait():
+            while not predicate():
+                self._state_changed.clear()
+                await self._state_changed.wait()
+        await asyncio.wait_for(wait(), timeout)
+
+
+class FakeGateway:
+    """Creates the fake guilds and dispatches their events to a client's handlers.
+
+    With `shard_ids` the client only gets the guilds of those shards, out of `shard_count`. Other guilds are still
+    created, so processes that build the same guilds in the same order see the same ids.
+    """
+
+    def __init__(self, api=None, *, shard_ids=None, shard_count=1, echo_delay=0):
+        self.api = api if api else FakeAPI()
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.echo_delay = echo_delay  # seconds from a member edit's response until its voice state update arrives
+        self.user = SimpleNamespace(id=new_id(), name="AmongBot", mention="<@bot>", bot=True)
+        self.guilds = []  # only the ones on our shards
+        self._guild_count = 0
+        self.client = None
+        self.cache_all_members = True  # else only members in voice, set from the client's member cache flags
+        self._tasks = set()
+        self.events = collections.Counter()
+
+    def add_guild(self, name=None):
+        guild = FakeGuild(self, self.api, name or f"guild {self._guild_count + 1}", self.user)
+        self._guild_count += 1
+        if self.shard_ids is None or (guild.id >> 22) % self.shard_count in self.shard_ids:
+            self.guilds.append(guild)
+        return guild
+
+    def dispatch(self, event, *args):
+        self.events[event] += 1
+        if self.client is None:
+            return
+        if event.startswith("member_") and not self.client.intents.members:
+            return
+        handler = getattr(self.client, f"on_{event}", None)
+        if handler:
+            task = asyncio.create_task(handler(*args))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def drain(self):
+        """Wait for every dispatched handler to finish, along with whatever they posted to the guild actors."""
+        while True:
+            if self._tasks:
+                await asyncio.gather(*self._tasks)
+            busy = [presence.actor for presence in self.client.presences if presence.actor.busy] if self.client else []
+            if not busy and not self._tasks:
+                return
+            for actor in busy:
+                await actor.join()
+
+
+class OfflineClient(Client):
+    """Client connected to a FakeGateway instead of Discord. Call start() instead of run()."""
+
+    def __init__(self, gateway, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.gateway = gateway
+        gateway.client = self
+        gateway.cache_all_members = self._connection.member_cache_flags.joined
+        self._started = False
+
+    @property
+    def user(self):
+        return self.gateway.user
+
+    @property
+    def guilds(self):
+        return self.gateway.guilds
+
+    def is_ready(self):
+        return self._started
+
+    @property
+    def latency(self):
+        return 0.0  # no heartbeats to measure
+
+    async def start(self):
+        for guild in self.guilds:
+            guild.chunk()
+        await self.on_ready()
+        self._started = True
+
+    async def reconnect(self):
+        """What the client sees when the gateway reconnects without resuming: on_ready again."""
+        await self.on_ready()
@@ -0,0 +1,144 @@
+import enum
+import heapq
+
+
+class MemberState(enum.Enum):
+    ALIVE = "alive"
+    DEAD = "dead"
+    IGNORED = "ignored"
+
+
+class TrackedMember:
+    """A member tracked by a session. Only keeps what the control panel shows: the discord.Member is looked up when it's
+    needed, so it doesn't have to stay in the client's cache."""
+    __slots__ = ("id", "display_name", "session", "state", "slot", "in_vc", "_mute")
+
+    def __init__(self, member, session, *, dead=False, mute=False, ignore=False):
+        self.id = member.id
+        self.display_name = member.display_name  # kept up to date by the session's event handlers
+        self.session = session
+        self.state = MemberState.IGNORED if ignore else MemberState.DEAD if dead else MemberState.ALIVE  # change through Roster.set_state()
+        self.slot = None  # index in the control panel, assigned by the Roster
+        self.in_vc = True  # change through Roster.set_in_vc()
+        self._mute = member.voice.mute if member.voice else mute  # last state confirmed by the server, updated by the MuteDispatcher
+
+    @classmethod
+    def restore(cls, session, member_id, display_name, state, slot):
+        """A member from a snapshot. Out of the channel until the session syncs its roster."""
+        self = cls.__new__(cls)
+        self.id = member_id
+        self.display_name = display_name
+        self.session = session
+        self.state = state
+        self.slot = slot
+        self.in_vc = False
+        self._mute = False  # the MuteDispatcher looks at the actual voice state while they're in voice
+        return self
+
+    def snapshot(self):
+        return [self.id, self.slot, self.state.value, self.display_name]
+
+    @property
+    def member(self):
+        """The discord.Member, or None if it isn't cached (with a voice-only member cache, after they left voice)."""
+        return self.session.guild.get_member(self.id)
+
+    @property
+    def mention(self):
+        return f"<@{self.id}>"
+
+    @property
+    def mute(self):
+        return self._mute
+
+    def set_mute(self, mute_state):
+        if self.state != MemberState.IGNORED and self.in_vc:
+            self.session.mute_dispatcher.request(self, True if self.state == MemberState.DEAD else mute_state)
+
+
+class Roster:
+    """Tracked members of a voice channel, indexed by member id and by control panel slot.
+
+    Slots stay with a member while they're tracked, even if they leave the channel for a while. Slots of removed members
+    get reused, lowest first.
+    """
+
+    def __init__(self):
+        self._by_id = {}
+        self._slots = []  # slot -> TrackedMember, None for free slots
+        self._free_slots = []  # heap
+        self._state_counts = dict.fromkeys(MemberState, 0)
+        self.in_vc_count = 0
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def __iter__(self):
+        """Iterate in slot order."""
+        return (tracked_member for tracked_member in self._slots if tracked_member is not None)
+
+    def __contains__(self, member_id):
+        return member_id in self._by_id
+
+    def get(self, member_id):
+        return self._by_id.get(member_id)
+
+    def by_slot(self, slot):
+        if 0 <= slot < len(self._slots):
+            return self._slots[slot]
+        return None
+
+    def count(self, state):
+        return self._state_counts[state]
+
+    def add(self, tracked_member):
+        if tracked_member.id in self._by_id:
+            self.remove(tracked_member.id)
+
+        if self._free_slots:
+            tracked_member.slot = heapq.heappop(self._free_slots)
+            self._slots[tracked_member.slot] = tracked_member
+        else:
+            tracked_member.slot = len(self._slots)
+            self._slots.append(tracked_member)
+        self._by_id[tracked_member.id] = tracked_member
+        self._state_counts[tracked_member.state] += 1
+        self.in_vc_count += tracked_member.in_vc
+        return tracked_member
+
+    def restore(self, tracked_members):
+        """Start over with members that already have a slot, e.g. from a snapshot."""
+        self.clear()
+        for tracked_member in tracked_members:
+            if tracked_member.id in self._by_id or tracked_member.slot < len(self._slots) and self._slots[tracked_member.slot]:
+                continue  # taken, a broken snapshot
+            self._slots.extend([None] * (tracked_member.slot + 1 - len(self._slots)))
+            self._slots[tracked_member.slot] = tracked_member
+            self._by_id[tracked_member.id] = tracked_member
+            self._state_counts[tracked_member.state] += 1
+            self.in_vc_count += tracked_member.in_vc
+        self._free_slots = [slot for slot, tracked_member in enumerate(self._slots) if tracked_member is None]
+        heapq.heapify(self._free_slots)
+
+    def remove(self, member_id):
+        tracked_member = self._by_id.pop(member_id, None)
+        if tracked_member is None:
+            return None
+
+        self._slots[tracked_member.slot] = None
+        heapq.heappush(self._free_slots, tracked_member.slot)
+        self._state_counts[tracked_member.state] -= 1
+        self.in_vc_count -= tracked_member.in_vc
+        return tracked_member
+
+    def clear(self):
+        self.__init__()
+
+    def set_state(self, tracked_member, state):
+        self._state_counts[tracked_member.state] -= 1
+        self._state_counts[state] += 1
+        tracked_member.state = state
+
+    def set_in_vc(self, tracked_member, in_vc):
+        self.in_vc_count += in_vc - tracked_member.in_vc
+        tracked_member.in_vc = in_vc
@@ -0,0 +1,69 @@
+class PresenceRouter:
+    """Index of BotPresences and their sessions, so gateway events go straight to whatever owns them.
+
+    Presences are indexed by guild id. Sessions are indexed by the ids of their text channel, voice channel and control
+    panel message, and must call reindex() whenever any of those change.
+    """
+
+    def __init__(self, presences=()):
+        self._guilds = {}
+        self._text_channels = {}
+        self._voice_channels = {}
+        self._panels = {}
+        self._keys = {}  # session -> (text channel id, voice channel id, panel id) currently indexed for it
+
+        for presence in presences:
+            self.add(presence)
+
+    def __iter__(self):
+        return iter(list(self._guilds.values()))
+
+    def __len__(self):
+        return len(self._guilds)
+
+    def add(self, presence):
+        if presence.guild.id in self._guilds:
+            self.remove(presence.guild.id)
+        self._guilds[presence.guild.id] = presence
+        for session in presence.sessions:
+            self.reindex(session)
+
+    def remove(self, guild_id):
+        presence = self._guilds.pop(guild_id, None)
+        if presence:
+            for session in presence.sessions:
+                self.unindex(session)
+        return presence
+
+    def reindex(self, session):
+        if self._guilds.get(session.guild.id) is not session.presence:  # not added yet, add() will index it
+            return
+        self.unindex(session)
+
+        keys = (
+            session.text_channel.id if session.text_channel else None,
+            session.voice_channel.id if session.voice_channel else None,
+            session.control_panel.message.id if session.control_panel.message else None
+        )
+        for index, key in zip((self._text_channels, self._voice_channels, self._panels), keys):
+            if key is not None:
+                index[key] = session
+        self._keys[session] = keys
+
+    def unindex(self, session):
+        keys = self._keys.pop(session, (None, None, None))
+        for index, key in zip((self._text_channels, self._voice_channels, self._panels), keys):
+            if key is not None and index.get(key) is session:
+                del index[key]
+
+    def by_guild(self, guild_id):
+        return self._guilds.get(guild_id)
+
+    def by_text_channel(self, channel_id):
+        return self._text_channels.get(channel_id)
+
+    def by_voice_channel(self, channel_id):
+        return self._voice_channels.get(channel_id)
+
+    def by_panel(self, message_id):
+        return self._panels.get(message_id)
@@ -0,0 +1,324 @@
+"""Runs the bot as several processes, each connected to a group of Discord shards, under a coordinator process.
+
+The coordinator splits the shards between the processes and starts them one at a time, since Discord only lets a bot
+identify so fast. It restarts processes that die, and merges the health and metrics reports they send it every few
+seconds, serving the merged metrics like a single process would.
+
+Every process uses the same guild store. A guild only ever belongs to one shard, and a process claims its shards in the
+store before connecting, so two processes never save the same guild, not even a stale one still shutting down.
+"""
+import asyncio
+import collections
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import sys
+import time
+
+import discord
+
+from .client import Client
+from .errors import StoreLockedError
+from .metrics import Metrics, metrics
+from .storage import GuildStore
+
+EXIT_CONFIG = 78  # a shard process exits with this when restarting it won't help, e.g. the token is wrong
+
+
+def shard_of(guild_id, shard_count):
+    return (guild_id >> 22) % shard_count
+
+
+def split_shards(shard_count, processes):
+    """Contiguous shard ids for each process, as even as possible."""
+    return [list(range(shard_count * n // processes, shard_count * (n + 1) // processes)) for n in range(processes)]
+
+
+async def recommended_shard_count(token):
+    http = discord.http.HTTPClient(asyncio.get_running_loop())
+    try:
+        await http.static_login(token)
+        shard_count, _, _ = await http.get_bot_gateway()
+        return shard_count
+    finally:
+        await http.close()
+
+
+class ShardedClient(Client, discord.AutoShardedClient):
+    """Client connected to the shards in `shard_ids`, out of `shard_count`."""
+
+
+def open_store(path, shard_ids, shard_count):
+    """The shared guild store, as seen by the process running `shard_ids`. Raises StoreLockedError if another process
+    still has one of them."""
+    store = GuildStore(path, owns=lambda guild_id: shard_of(guild_id, shard_count) in shard_ids)
+    for shard_id in shard_ids:
+        store.claim(f"shard-{shard_id}")
+    return store
+
+
+class ShardReporter:
+    """Sends the coordinator this process's health and metrics every `interval` seconds."""
+
+    def __init__(self, client, connection, *, index, shard_ids, interval=5):
+        self.client = client
+        self.connection = connection
+        self.index = index
+        self.shard_ids = shard_ids
+        self.interval = interval
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+
+    def health(self):
+        client = self.client
+        if isinstance(client, discord.AutoShardedClient):
+            latencies = dict(client.latencies)
+        else:
+            latencies = {shard_id: client.latency for shard_id in self.shard_ids}
+        presences = list(client.presences)
+        return {
+            "index": self.index,
+            "pid": os.getpid(),
+            "shard_ids": self.shard_ids,
+            "ready": client.is_ready(),
+            "guilds": len(presences),
+            "sessions": sum(len(presence.sessions) for presence in presences),
+            "events": sum(presence.actor.events_handled for presence in presences),
+            "latencies": latencies,
+        }
+
+    async def report(self):
+        report = {"health": self.health(), "metrics": metrics.snapshot() if metrics.enabled else None}
+        await asyncio.get_running_loop().run_in_executor(None, self.connection.send, report)  # pickling a big snapshot can take a while
+
+    async def _run(self):
+        while True:
+            ready = self.client.is_ready()
+            try:
+                await self.report()
+            except (EOFError, OSError):  # coordinator is gone
+                return
+            # report early when the client gets ready or loses the connection, the coordinator waits for that
+            deadline = time.monotonic() + self.interval
+            while time.monotonic() < deadline and self.client.is_ready() == ready:
+                await asyncio.sleep(0.1)
+
+
+async def run_until_terminated(client, coroutine):
+    """Run a shard process until the coordinator terminates it, then close the client so the store gets flushed."""
+    task = asyncio.create_task(coroutine)
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, task.cancel)
+    except NotImplementedError:  # Windows, where terminating a process kills it right away anyway
+        pass
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    finally:
+        await client.close()
+
+
+def run_shard_group(index, shard_ids, shard_count, connection, token, options):
+    """Process target for a group of Discord shards. `options` are Client keyword arguments, plus the store's "store_path"."""
+    asyncio.run(_run_shard_group(index, shard_ids, shard_count, connection, token, dict(options)))
+
+
+async def _run_shard_group(index, shard_ids, shard_count, connection, token, options):
+    metrics.enabled = options.pop("metrics", False)
+    try:
+        store = open_store(options.pop("store_path"), shard_ids, shard_count)
+    except StoreLockedError as error:
+        print(f"Shard process {index} can't start yet: {error}")
+        return
+    # every process needs its own control socket, clients pick the one with their guild's shard
+    if options.get("control_port"):
+        options["control_port"] += index
+    if options.get("control_socket"):
+        options["control_socket"] += f".{index}"
+
+    client = ShardedClient(shard_ids=shard_ids, shard_count=shard_count, store=store, **options)
+    reporter = ShardReporter(client, connection, index=index, shard_ids=shard_ids)
+    reporter.start()
+    try:
+        await run_until_terminated(client, client.start(token))
+    except (discord.LoginFailure, discord.PrivilegedIntentsRequired) as error:
+        print(f"Shard process {index}: {error}")
+        sys.exit(EXIT_CONFIG)
+
+
+class ShardProcess:
+    """The coordinator's side of one shard process."""
+
+    def __init__(self, index, shard_ids):
+        self.index = index
+        self.shard_ids = shard_ids
+        self.process = None
+        self.connection = None
+        self.started_at = None
+        self.restarts = 0
+
+        # from its last report
+        self.health = None
+        self.metrics = None
+        self.reported_at = None
+
+    @property
+    def alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    @property
+    def ready(self):
+        return self.alive and self.health is not None and self.health["ready"]
+
+
+class Coordinator:
+    """Starts and looks after the shard processes, and merges what they report.
+
+    `target(index, shard ids, shard count, connection, *args)` runs in each process, and must be importable from a
+    fresh interpreter. It should send ShardReporter reports through `connection`.
+    """
+
+    def __init__(self, target, *, shard_count, processes, args=(), restart_delay=5, start_timeout=120):
+        self.target = target
+        self.args = args
+        self.shard_count = shard_count
+        self.restart_delay = restart_delay
+        self.start_timeout = start_timeout  # seconds to wait for a process to be ready before starting the next one
+        self.processes = [ShardProcess(index, shard_ids) for index, shard_ids in enumerate(split_shards(shard_count, processes))]
+        self.metrics = Metrics(enabled=True)  # merged from every process's reports
+        self._context = multiprocessing.get_context("spawn")  # same on every platform, and no copy of our event loop
+        self._pending = collections.deque(self.processes)  # waiting to be (re)started, in order
+        self._not_before = {}  # process index -> when it can be restarted
+        self._stopping = False
+
+    def health(self):
+        now = time.monotonic()
+        return [{
+            "index": shard_process.index,
+            "shard_ids": shard_process.shard_ids,
+            "alive": shard_process.alive,
+            "ready": shard_process.ready,
+            "restarts": shard_process.restarts,
+            "report_age": now - shard_process.reported_at if shard_process.reported_at else None,
+            **{key: value for key, value in (shard_process.health or {}).items() if key not in ("index", "shard_ids", "ready")},
+        } for shard_process in self.processes]
+
+    def stop(self):
+        self._stopping = True
+
+    async def run(self, *, metrics_port=None):
+        """Start every process and look after them until stop() is called, then terminate them."""
+        if metrics_port:
+            await self.metrics.serve(port=metrics_port)
+        loop = asyncio.get_running_loop()
+        starting = None
+        try:
+            while not self._stopping:
+                # start the next process once the previous one is ready, so only one group of shards identifies at a time
+                if starting and (starting.ready or not starting.alive or time.monotonic() - starting.started_at > self.start_timeout):
+                    starting = None
+                if starting is None and self._pending and self._not_before.get(self._pending[0].index, 0) <= time.monotonic():
+                    starting = self._pending.popleft()
+                    self._start(starting)
+
+                waitables = {}
+                for shard_process in self.processes:
+                    if shard_process.connection:
+                        waitables[shard_process.connection] = shard_process
+                    if shard_process.process:
+                        waitables[shard_process.process.sentinel] = shard_process
+                ready = await loop.run_in_executor(None, multiprocessing.connection.wait, list(waitables), 0.5)
+                for waitable in ready:
+                    shard_process = waitables[waitable]
+                    if waitable is shard_process.connection:
+                        self._receive(shard_process)
+                    elif shard_process.process and not shard_process.process.is_alive():
+                        self._exited(shard_process)
+        finally:
+            await loop.run_in_executor(None, self._terminate)
+            self.metrics.close()
+
+    def _start(self, shard_process):
+        receiver, sender = self._context.Pipe(duplex=False)
+        process = self._context.Process(
+            target=self.target,
+            args=(shard_process.index, shard_process.shard_ids, self.shard_count, sender, *self.args),
+            name=f"amongbot-shards-{shard_process.index}"
+        )
+        try:
+            process.start()
+        except BaseException:
+            receiver.close()
+            raise
+        finally:
+            sender.close()  # the child has its own copy, this way the receiver sees EOF once the child is gone
+        shard_process.process = process
+        shard_process.connection = receiver
+        shard_process.started_at = time.monotonic()
+        shard_process.health = None
+        print(f"Started shard process {shard_process.index} (pid {shard_process.process.pid}) for shards {shard_process.shard_ids}")
+
+    def _receive(self, shard_process):
+        try:
+            report = shard_process.connection.recv()
+        except (EOFError, OSError):  # exiting, the sentinel tells when it's done
+            shard_process.connection.close()
+            shard_process.connection = None
+            return
+        shard_process.health = report["health"]
+        if report["metrics"] is not None:
+            shard_process.metrics = report["metrics"]
+        shard_process.reported_at = time.monotonic()
+        self._merge()
+
+    def _exited(self, shard_process):
+        exit_code = shard_process.process.exitcode
+        shard_process.process.close()
+        shard_process.process = None
+        if shard_process.connection:
+            shard_process.connection.close()
+            shard_process.connection = None
+        if self._stopping:
+            return
+        if exit_code == EXIT_CONFIG:
+            print(f"Shard process {shard_process.index} can't run with this configuration, stopping")
+            self.stop()
+            return
+        shard_process.restarts += 1
+        self._not_before[shard_process.index] = time.monotonic() + self.restart_delay
+        self._pending.append(shard_process)
+        print(f"Shard process {shard_process.index} exited with code {exit_code}, restarting it in {self.restart_delay}s")
+        self._merge()
+
+    def _merge(self):
+        # counters of a restarted process start over from its replacement's first report, Prometheus handles the reset
+        self.metrics.clear()
+        for shard_process in self.processes:
+            if shard_process.metrics:
+                self.metrics.merge(shard_process.metrics)
+            self.metrics.set("shard_process_up", int(shard_process.ready), str(shard_process.index))
+            self.metrics.set("shard_process_restarts", shard_process.restarts, str(shard_process.index))
+            health = shard_process.health or {}
+            if "guilds" in health:
+                self.metrics.set("shard_process_guilds", health["guilds"], str(shard_process.index))
+            for shard_id, latency in health.get("latencies", {}).items():
+                self.metrics.set("shard_latency_seconds", latency, str(shard_id))
+
+    def _terminate(self, timeout=10):
+        for shard_process in self.processes:
+            if shard_process.alive:
+                shard_process.process.terminate()  # SIGTERM, they close their clients and flush the store
+        for shard_process in self.processes:
+            if shard_process.process:
+                shard_process.process.join(timeout)
+                if shard_process.process.is_alive():
+                    shard_process.process.kill()
+                    shard_process.process.join()
@@ -0,0 +1,133 @@
+import asyncio
+import json
+import os
+import tempfile
+
+try:
+    import fcntl
+except ImportError:  # Windows, claim() can't lock there
+    fcntl = None
+
+from .errors import StoreLockedError
+
+
+class GuildStore:
+    """Per-guild settings storage, one JSON file per guild inside `path`.
+
+    Saves are write-behind: save() only remembers the data, and a background task writes dirty guilds off the event
+    loop every `flush_interval` seconds. Files are replaced atomically, so a crash mid-write never corrupts them.
+
+    Several processes can share a store as long as each guild is saved by only one of them: with shards, every process
+    claim()s its shards and only saves guilds it `owns`.
+    """
+
+    def __init__(self, path="data", *, flush_interval=5, owns=None):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.owns = owns  # guild id -> whether this process may save it, None for all guilds
+        self._locks = {}  # name -> open lock file
+        self._dirty = {}  # guild id -> data waiting to be written
+        self._writing = {}  # guild id -> data of the flush in progress, newer than the files until it's done
+        self._flush_task = None
+        self._closing = asyncio.Event()  # wakes the pending flush early
+        self._flush_lock = asyncio.Lock()
+
+        os.makedirs(self.path, exist_ok=True)
+
+    def _file(self, guild_id):
+        return os.path.join(self.path, f"{guild_id}.json")
+
+    def migrate(self, legacy_path="data.json"):
+        """Split an old all-guilds data.json into per-guild files. The old file is kept as `<name>.bak`."""
+        try:
+            with open(legacy_path) as legacy_file:
+                legacy_data = json.load(legacy_file)
+        except FileNotFoundError:
+            return
+        except json.JSONDecodeError:
+            if os.stat(legacy_path).st_size == 0:
+                legacy_data = {}
+            else:
+                raise
+
+        for guild_id, data in legacy_data.items():
+            if not os.path.exists(self._file(guild_id)):  # don't overwrite anything newer
+                self._write(guild_id, data)
+        os.replace(legacy_path, legacy_path + ".bak")
+        print(f"Migrated {len(legacy_data)} guilds from {legacy_path} to {self.path}/")
+
+    async def load(self, guild_id):
+        if guild_id in self._dirty:
+            return self._dirty[guild_id]
+        if guild_id in self._writing:
+            return self._writing[guild_id]
+        return await asyncio.get_running_loop().run_in_executor(None, self._read, guild_id)
+
+    def _read(self, guild_id):
+        try:
+            with open(self._file(guild_id)) as save_file:
+                return json.load(save_file)
+        except FileNotFoundError:
+            return None
+
+    def claim(self, name):
+        """Lock `name` (e.g. a shard) for this process until close(). Raises StoreLockedError if another process has it."""
+        lock_file = open(os.path.join(self.path, f".{name}.lock"), "w")
+        if fcntl:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock_file.close()
+                raise StoreLockedError(name)
+        self._locks[name] = lock_file  # the lock goes away with the file, also when the process dies
+
+    def save(self, guild_id, data):
+        if self.owns and not self.owns(guild_id):
+            print(f"Not saving guild {guild_id}, it belongs to another shard")
+            return
+        self._dirty[guild_id] = data
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        try:
+            await asyncio.wait_for(self._closing.wait(), self.flush_interval)
+        except asyncio.TimeoutError:
+            pass
+        await self.flush()
+
+    async def flush(self):
+        async with self._flush_lock:
+            dirty, self._dirty = self._dirty, {}
+            if dirty:
+                self._writing = dirty
+                try:
+                    await asyncio.get_running_loop().run_in_executor(None, self._write_all, dirty)
+                finally:
+                    self._writing = {}
+
+    def _write_all(self, dirty):
+        for guild_id, data in dirty.items():
+            self._write(guild_id, data)
+
+    def _write(self, guild_id, data):
+        # write to a temporary file in the same directory, then rename it over the old one
+        fd, temp_path = tempfile.mkstemp(dir=self.path, prefix=f".{guild_id}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as temp_file:
+                json.dump(data, temp_file)
+                temp_file.flush()
+                os.fsync(temp_file.fileno())
+            os.replace(temp_path, self._file(guild_id))
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    async def close(self):
+        self._closing.set()
+        if self._flush_task:
+            await self._flush_task
+        await self.flush()
+        for lock_file in self._locks.values():
+            lock_file.close()
+        self._locks.clear()
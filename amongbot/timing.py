@@ -0,0 +1,15 @@
+import contextlib
+import time
+
+
+@contextlib.contextmanager
+def timed(timings, name):
+    """Add the time spent inside the block to timings[name]. Does nothing if timings is None."""
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0) + time.perf_counter() - start
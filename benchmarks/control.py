@@ -0,0 +1,114 @@
+"""Load test of the control socket, with a local client driving an offline bot over TCP.
+
+Measures round trips one request at a time, then floods the socket with pipelined requests to see the throughput and
+whether backpressure keeps the bot's backlog bounded.
+Run from the repository root with `python3 -m benchmarks.control`.
+"""
+import asyncio
+import statistics
+import tempfile
+import time
+
+from amongbot.control import read_frame, write_frame
+from amongbot.offline import FakeAPI, FakeGateway
+from amongbot.storage import GuildStore
+
+from .replay import BUCKETS, percentile, settle, setup_guild, start_client
+
+TOKEN = "benchmark"
+PLAYERS = 15
+SEQUENTIAL = 2000
+FLOOD = 200000
+
+
+def requests(members, count, start_id=2):
+    """Alternating mute toggles and dead/alive updates of a few members."""
+    for n in range(count):
+        if n % 2:
+            yield {"op": "mute", "id": start_id + n}
+        else:
+            yield {"op": "states", "id": start_id + n, "members": {str(member.id): "dead" if n % 4 else "alive" for member in members[n % 5:n % 5 + 3]}}
+
+
+async def sequential(reader, writer, members):
+    round_trips, queued, handled = [], [], []
+    for request in requests(members, SEQUENTIAL):
+        start = time.perf_counter()
+        write_frame(writer, request)
+        await writer.drain()
+        reply = await read_frame(reader)
+        round_trips.append(time.perf_counter() - start)
+        assert reply["ok"] and reply["id"] == request["id"], reply
+        queued.append(reply["queued_us"])
+        handled.append(reply["handled_us"])
+    return round_trips, queued, handled
+
+
+async def flood(reader, writer, members, actor):
+    acked = 0
+    blocked = 0
+    max_mailbox = 0
+
+    post = actor.post
+
+    def watched_post(*args):
+        nonlocal max_mailbox
+        post(*args)
+        max_mailbox = max(max_mailbox, len(actor._mailbox))
+    actor.post = watched_post
+
+    async def send():
+        nonlocal blocked
+        for n, request in enumerate(requests(members, FLOOD, start_id=SEQUENTIAL + 2)):
+            write_frame(writer, request)
+            if n % 100 == 0:
+                start = time.perf_counter()
+                await writer.drain()  # blocks once the server stops reading and the socket buffers are full
+                blocked += time.perf_counter() - start
+        await writer.drain()
+
+    async def receive():
+        nonlocal acked
+        while acked < FLOOD:
+            reply = await read_frame(reader)
+            assert reply["ok"], reply
+            acked += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(send(), receive())
+    del actor.post
+    return time.perf_counter() - start, blocked, max_mailbox
+
+
+async def bench():
+    with tempfile.TemporaryDirectory() as path:
+        gateway = FakeGateway(FakeAPI(latency=0.02, buckets=BUCKETS))
+        store = GuildStore(path)
+        guild, text_channel, voice_channel, members = setup_guild(gateway, store, players=PLAYERS, configured=False)
+        client = await start_client(gateway, store, control_port=0, control_token=TOKEN)
+        text_channel.post(members[0], "among:setup")
+        await gateway.drain()
+        await settle(client)
+
+        reader, writer = await asyncio.open_connection("127.0.0.1", client.control.port)
+        write_frame(writer, {"op": "bind", "id": 1, "token": TOKEN, "voice": voice_channel.id})
+        assert (await read_frame(reader))["ok"]
+
+        round_trips, queued, handled = await sequential(reader, writer, members)
+        print(f"sequential: {SEQUENTIAL} requests, round trip p50 {percentile(round_trips, 50) * 1e6:.0f}us "
+              f"p99 {percentile(round_trips, 99) * 1e6:.0f}us, queued mean {statistics.mean(queued):.0f}us, handled mean {statistics.mean(handled):.0f}us")
+
+        edits_before = gateway.api.calls["member.edit"]
+        elapsed, blocked, max_mailbox = await flood(reader, writer, members, client.presences.by_guild(guild.id).actor)
+        print(f"flood: {FLOOD} requests in {elapsed:.2f}s ({FLOOD / elapsed:.0f}/s), client blocked by backpressure for {blocked:.2f}s, "
+              f"guild actor mailbox at most {max_mailbox} (server allows {client.control.max_in_flight} in flight)")
+        writer.close()
+
+        await gateway.drain()
+        await settle(client)
+        print(f"member edits sent during the flood: {gateway.api.calls['member.edit'] - edits_before}")
+        await client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(bench())
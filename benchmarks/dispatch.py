@@ -0,0 +1,107 @@
+"""Per-event dispatch cost of Client's gateway handlers as the number of guilds grows.
+
+Run from the repository root with `python3 -m benchmarks.dispatch`.
+"""
+import asyncio
+import tempfile
+import time
+from types import SimpleNamespace
+
+import discord
+
+from amongbot.actor import GuildActor
+from amongbot.client import Client
+from amongbot.storage import GuildStore
+
+GUILD_COUNTS = (10, 100, 1000, 5000)
+EVENTS = 20000
+
+
+class DummySession:
+    def __init__(self, presence, guild_id):
+        self.presence = presence
+        self.guild = presence.guild
+        self.text_channel = SimpleNamespace(id=guild_id * 10 + 1)
+        self.voice_channel = SimpleNamespace(id=guild_id * 10 + 2)
+        self.control_panel = SimpleNamespace(message=SimpleNamespace(id=guild_id * 10 + 3))
+        self.calls = 0
+
+    async def on_message(self, message):
+        self.calls += 1
+
+    async def on_voice_state_update(self, member, before, after):
+        self.calls += 1
+
+    async def on_reaction_add(self, emoji, message_id, member):
+        self.calls += 1
+
+
+class DummyPresence:
+    def __init__(self, guild_id):
+        self.guild = SimpleNamespace(id=guild_id)
+        self.sessions = [DummySession(self, guild_id)]
+        self.actor = GuildActor(self)
+
+    def hold(self):
+        pass
+
+    def release(self):
+        pass
+
+    async def save(self, *, force=False):
+        pass
+
+
+def make_events(guild_count):
+    guild_ids = list(range(1, guild_count + 1))
+    messages, voice_updates = [], []
+    for n in range(EVENTS):
+        guild_id = guild_ids[n % guild_count]
+        # half the messages happen outside the tracked text channel and get dropped
+        channel_id = guild_id * 10 + 1 if n % 2 else guild_id * 10 + 9
+        messages.append(SimpleNamespace(author=object(), guild=SimpleNamespace(id=guild_id), channel=SimpleNamespace(id=channel_id), content="hi"))
+        before = SimpleNamespace(channel=None)  # a join
+        after = SimpleNamespace(channel=SimpleNamespace(id=guild_id * 10 + 2))
+        voice_updates.append((object(), before, after))
+    return messages, voice_updates
+
+
+async def drain(client):
+    for presence in client.presences:
+        await presence.actor.join()
+
+
+async def bench(guild_count):
+    with tempfile.TemporaryDirectory() as path:
+        return await _bench(guild_count, GuildStore(path))
+
+
+async def _bench(guild_count, store):
+    client = Client(intents=discord.Intents.default(), store=store, presences=[DummyPresence(guild_id) for guild_id in range(1, guild_count + 1)])
+    messages, voice_updates = make_events(guild_count)
+
+    start = time.perf_counter()
+    for message in messages:
+        await client.on_message(message)
+    await drain(client)
+    message_time = (time.perf_counter() - start) / EVENTS
+
+    start = time.perf_counter()
+    for member, before, after in voice_updates:
+        await client.on_voice_state_update(member, before, after)
+    await drain(client)
+    voice_time = (time.perf_counter() - start) / EVENTS
+
+    await client.close()
+    return message_time, voice_time
+
+
+def main():
+    print(f"{'guilds':>8} {'message (us/event)':>20} {'voice (us/event)':>18}")
+    for guild_count in GUILD_COUNTS:
+        message_time, voice_time = asyncio.run(bench(guild_count))
+        print(f"{guild_count:>8} {message_time * 1e6:>20.2f} {voice_time * 1e6:>18.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Memory use of the bot with and without low memory mode, in guilds with lots of members that never join voice.
+
+Each mode runs in its own process against the offline Discord stand-in, which emulates the member cache: with the
+default intents every member is fetched at startup (chunking) and cached, in low memory mode only members in voice are.
+Run from the repository root with `python3 -m benchmarks.memory`.
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+
+from amongbot.offline import FakeAPI, FakeGateway
+from amongbot.storage import GuildStore
+
+from .replay import BUCKETS, settle, setup_guild, start_client
+
+GUILDS = 20
+IDLE_MEMBERS = 5000  # per guild
+PLAYERS = 10
+
+
+def rss():
+    """Resident set size in bytes, the peak one where /proc isn't available."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+async def run(low_memory):
+    with tempfile.TemporaryDirectory() as path:
+        gateway = FakeGateway(FakeAPI(latency=0.001, buckets=BUCKETS))
+        store = GuildStore(path)
+        lobbies = []
+        for _ in range(GUILDS):
+            guild, text_channel, voice_channel, members = setup_guild(gateway, store, players=PLAYERS)
+            guild.add_idle_members(IDLE_MEMBERS)
+            lobbies.append((guild, members))
+        await store.flush()
+
+        before = rss()
+        client = await start_client(gateway, store, low_memory=low_memory)
+        for guild, members in lobbies:  # one meeting in every guild
+            session = client.presences.by_guild(guild.id).sessions[0]
+            session.control_panel.message.click("🔈", members[0])
+        for guild, members in lobbies:
+            await guild.wait_until(lambda: all(member.voice.mute for member in members))
+        await gateway.drain()
+        await settle(client)
+        after = rss()
+
+        result = {
+            "rss_growth": after - before,
+            "rss": after,
+            "cached_members": sum(len(guild.members) for guild, _ in lobbies),
+            "tracked_members": sum(len(session.roster) for presence in client.presences for session in presence.sessions),
+            "member_edits": gateway.api.calls["member.edit"],
+        }
+        await client.close()
+    return result
+
+
+def measure(low_memory):
+    """Runs a mode in a fresh process, so one doesn't inherit the other's heap."""
+    command = [sys.executable, "-m", "benchmarks.memory", "--child"] + (["--low-memory"] if low_memory else [])
+    output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--low-memory", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--json", action="store_true", help="print machine readable results")
+    args = parser.parse_args()
+    if args.child:
+        print(json.dumps(asyncio.run(run(args.low_memory))))
+        return
+
+    results = {"default": measure(False), "low-memory": measure(True)}
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{GUILDS} guilds, each with {PLAYERS} members in voice and {IDLE_MEMBERS} that never join")
+    for name, result in results.items():
+        print(f"== {name}")
+        print(f"  rss: {result['rss'] / 2 ** 20:.1f}MiB, {result['rss_growth'] / 2 ** 20:.1f}MiB of it from starting the client")
+        print(f"  cached members: {result['cached_members']}, tracked: {result['tracked_members']}, member edits: {result['member_edits']}")
+
+
+if __name__ == "__main__":
+    main()
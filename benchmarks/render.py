@@ -0,0 +1,49 @@
+"""Control panel rendering cost for different roster sizes.
+
+Measures a cold render (nothing cached), a warm render with nothing changed and a warm render where one member changed.
+Run from the repository root with `python3 -m benchmarks.render`.
+"""
+import timeit
+from types import SimpleNamespace
+
+from amongbot.botpresence import ControlPanel
+from amongbot.roster import Roster, TrackedMember, MemberState
+
+MEMBER_COUNTS = (10, 100, 500)
+REPEAT = 200
+
+
+def make_panel(member_count):
+    session = SimpleNamespace(muting=False, mimics=[], playing_cues=False, roster=Roster())
+    for n in range(member_count):
+        member = SimpleNamespace(id=n, display_name=f"player{n}", mention=f"<@{n}>", voice=SimpleNamespace(mute=False))
+        session.roster.add(TrackedMember(member, session))
+    return ControlPanel(session)
+
+
+def main():
+    print(f"{'members':>8} {'cold (us)':>12} {'warm (us)':>12} {'1 change (us)':>14} {'pages':>6}")
+    for member_count in MEMBER_COUNTS:
+        panel = make_panel(member_count)
+
+        def render_cold():
+            panel._lines = {}
+            panel.render()
+        cold = min(timeit.repeat(render_cold, number=1, repeat=REPEAT))
+
+        pages = panel.render()
+        warm = min(timeit.repeat(panel.render, number=1, repeat=REPEAT))
+
+        roster = panel.session.roster
+        tracked_member = roster.by_slot(member_count // 2)
+
+        def render_changed():
+            roster.set_state(tracked_member, MemberState.DEAD if tracked_member.state == MemberState.ALIVE else MemberState.ALIVE)
+            panel.render()
+        changed = min(timeit.repeat(render_changed, number=1, repeat=REPEAT))
+
+        print(f"{member_count:>8} {cold * 1e6:>12.1f} {warm * 1e6:>12.1f} {changed * 1e6:>14.1f} {len(pages):>6}")
+
+
+if __name__ == "__main__":
+    main()
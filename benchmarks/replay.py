@@ -0,0 +1,496 @@
+"""Replays scripted event storms through the real Client handlers, against the offline Discord stand-in.
+
+Reports the REST calls issued, time from a toggle until everyone is (un)muted, and event loop lag.
+Rate limit windows are 10 times shorter than Discord's so the scenarios finish quickly.
+Run from the repository root with `python3 -m benchmarks.replay [scenario...] [--json]`.
+"""
+import argparse
+import asyncio
+import functools
+import json
+import statistics
+import tempfile
+import time
+
+from amongbot.actions import PANEL_EMOJIS
+from amongbot.offline import FakeAPI, FakeGateway, OfflineClient
+from amongbot.roster import MemberState
+from amongbot.storage import GuildStore
+
+
+BUCKETS = {
+    "member.edit": (10, 1),
+    "message.edit": (5, 0.5),
+    "reaction": (1, 0.025),
+}
+MUTE_RATE = (10, 1)
+
+
+def percentile(values, percent):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+class LoopLagMonitor:
+    """Measures how late a task that wants to wake up every `interval` seconds actually wakes up."""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.lags = []
+        self._task = None
+
+    async def _run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.lags.append(time.perf_counter() - start - self.interval)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        self._task.cancel()
+
+
+def setup_guild(gateway, store, *, players, configured=True):
+    """A guild with a text channel, a voice channel with `players` members in it and, if configured, saved settings.
+
+    Call before creating the client, so these events aren't dispatched.
+    """
+    guild = gateway.add_guild()
+    text_channel = guild.add_text_channel()
+    voice_channel = guild.add_voice_channel()
+    members = [guild.add_member(f"player{n}") for n in range(players)]
+    for member in members:
+        member.join(voice_channel)
+
+    if configured:
+        panel = text_channel.post(guild.me, "Loading...")
+        for emoji in PANEL_EMOJIS:
+            panel.click(emoji, guild.me)
+        store.save(guild.id, {"sessions": [{"text": text_channel.id, "voice": voice_channel.id, "control": panel.id, "pages": []}], "exclude": []})
+    return guild, text_channel, voice_channel, members
+
+
+async def settle(client):
+    """Wait for pending control panel edits."""
+    for presence in client.presences:
+        for session in presence.sessions:
+            if session.control_panel._update_task:
+                await session.control_panel._update_task
+
+
+async def start_client(gateway, store, **kwargs):
+    client = OfflineClient(gateway, store=store, mute_rate=MUTE_RATE, **kwargs)
+    await client.start()
+    await gateway.drain()
+    return client
+
+
+async def scenario_restart(latency, guilds=500, players=5):
+    """Many configured guilds, all set up at once on startup."""
+    with tempfile.TemporaryDirectory() as path:
+        gateway = FakeGateway(FakeAPI(latency=latency, buckets=BUCKETS))
+        store = GuildStore(path)
+        for _ in range(guilds):
+            setup_guild(gateway, store, players=players)
+        await store.flush()
+
+        monitor = LoopLagMonitor()
+        monitor.start()
+        start = time.perf_counter()
+        client = await start_client(gateway, store)
+        await settle(client)
+        elapsed = time.perf_counter() - start
+        monitor.stop()
+        await client.close()
+    return {"startup": elapsed, "loop_lags": monitor.lags, "api": gateway.api}
+
+
+SILENCE = (b"\xf8\xff\xfe",) * 50  # one second of Opus silence, stands in for cue files
+
+
+async def scenario_meeting(latency, players=15, toggles=20, cues=False):
+    """One 15 player lobby toggling mute for every meeting, optionally with audio cues."""
+    with tempfile.TemporaryDirectory() as path:
+        gateway = FakeGateway(FakeAPI(latency=latency, buckets=BUCKETS))
+        store = GuildStore(path)
+        guild, text_channel, voice_channel, members = setup_guild(gateway, store, players=players, configured=False)
+        client = await start_client(gateway, store)
+
+        text_channel.post(members[0], "among:setup")
+        await gateway.drain()
+        await settle(client)
+        session = client.presences.by_text_channel(text_channel.id)
+        session.mute_delay = 0
+        session.control_panel.click_window = 0  # the same member clicks every time
+        if cues:
+            client.cues.frames = {"mute": SILENCE, "unmute": SILENCE}
+            session.control_panel.message.click("🔔", members[1])
+            await gateway.drain()
+
+        latencies = []
+        monitor = LoopLagMonitor()
+        monitor.start()
+        for toggle in range(toggles):
+            muting = not session.muting
+            start = time.perf_counter()
+            session.control_panel.message.click("🔈", members[0])
+            await guild.wait_until(lambda: all(member.voice.mute == muting for member in members))
+            latencies.append(time.perf_counter() - start)
+            await gateway.drain()
+        await settle(client)
+        monitor.stop()
+        result = {"toggle_latencies": latencies, "loop_lags": monitor.lags, "api": gateway.api}
+        if cues:
+            result["cues_played"] = session.presence.voice.voice_client.plays
+        await client.close()
+    return result
+
+
+async def scenario_slow_echo(latency, players=10, toggles=10, echo_delay=0.1):
+    """Toggling back right after the edits returned, before their voice state updates arrived."""
+    with tempfile.TemporaryDirectory() as path:
+        gateway = FakeGateway(FakeAPI(latency=latency, buckets=BUCKETS), echo_delay=echo_delay)
+        store = GuildStore(path)
+        guild, text_channel, voice_channel, members = setup_guild(gateway, store, players=players, configured=False)
+        client = await start_client(gateway, store)
+
+        text_channel.post(members[0], "among:setup")
+        await gateway.drain()
+        session = client.presences.by_text_channel(text_channel.id)
+        session.mute_delay = 0
+        session.control_panel.click_window = 0
+
+        start = time.perf_counter()
+        for toggle in range(toggles):
+            session.control_panel.message.click("🔈", members[0])
+            await gateway.drain()
+            while session.mute_dispatcher.busy:
+                await asyncio.sleep(0.005)
+        await guild.wait_until(lambda: all(member.voice.mute == session.muting for member in members))
+        elapsed = time.perf_counter() - start
+        await gateway.drain()
+        await settle(client)
+        result = {"toggles": elapsed, "ignored": session.roster.count(MemberState.IGNORED), "api": gateway.api}
+        await client.close()
+    return result
+
+
+async def scenario_churn(latency, players=30, moves=300, low_memory=False):
+    """Members constantly joining and leaving the tracked channel."""
+    with tempfile.TemporaryDirectory() as path:
+        gateway = FakeGateway(FakeAPI(latency=latency, buckets=BUCKETS))
+        store = GuildStore(path)
+        guild, text_channel, voice_channel, members = setup_guild(gateway, store, players=players, configured=False)
+        lobby = guild.add_voice_channel("Lobby")
+        client = await start_client(gateway, store, low_memory=low_memory)
+
+        text_channel.post(members[0], "among:setup")
+        await gateway.drain()
+
+        monitor = LoopLagMonitor()
+        monitor.start()
+        start = time.perf_counter()
+        for move in range(moves):
+            member = members[1 + move % (players - 1)]  # members[0] stays, so the session isn't reset
+            if member.voice and member.voice.channel is voice_channel:
+                member.leave() if low_memory else member.join(lobby)  # leaving voice drops them from a voice-only cache
+            else:
+                member.join(voice_channel)
+            await asyncio.sleep(0.001)
+        await gateway.drain()
+        await settle(client)
+        elapsed = time.perf_counter() - start
+        monitor.stop()
+        await client.close()
+    return {"churn": elapsed, "loop_lags": monitor.lags, "api": gateway.api}
+
+
+async def scenario_spam(latency, players=10, clickers=5, clicks=20):
+    """Several members spam-clicking the mute button at once."""
+    with tempfile.TemporaryDirectory() as path:
+        gateway = FakeGateway(FakeAPI(latency=latency, buckets=BUCKETS))
+        store = GuildStore(path)
+        guild, text_channel, voice_channel, members = setup_guild(gateway, store, players=players, configured=False)
+        client = await start_client(gateway, store)
+
+        text_channel.post(members[0], "among:setup")
+        await gateway.drain()
+        await settle(client)
+        session = client.presences.by_text_channel(text_channel.id)
+        panel = session.control_panel
+        gateway.api.calls.clear()
+
+        monitor = LoopLagMonitor()
+        monitor.start()
+        start = time.perf_counter()
+        for click in range(clicks):
+            for member in members[:clickers]:
+                panel.message.click("🔈", member)
+            await asyncio.sleep(0.05)
+        await gateway.drain()
+        await settle(client)
+        while panel._removal_task and not panel._removal_task.done():
+            await panel._removal_task
+        elapsed = time.perf_counter() - start
+        monitor.stop()
+        await client.close()
+    return {"spam": elapsed, "clicks": clicks * clickers, "clicks_collapsed": panel.clicks_collapsed,
+            "reactions_removed": panel.reactions_removed, "loop_lags": monitor.lags, "api": gateway.api}
+
+
+async def scenario_storm(latency, players=15, extras=10, bursts=10, burst_size=60, batching=True):
+    """Bursts of toggles, dead/alive changes and members hopping in and out of the channel, all at once."""
+    with tempfile.TemporaryDirectory() as path:
+        gateway = FakeGateway(FakeAPI(latency=latency, buckets=BUCKETS))
+        store = GuildStore(path)
+        guild, text_channel, voice_channel, members = setup_guild(gateway, store, players=players, configured=False)
+        lobby = guild.add_voice_channel("Lobby")
+        hoppers = [guild.add_member(f"hopper{n}") for n in range(extras)]
+        for member in hoppers:
+            member.join(lobby)
+        client = await start_client(gateway, store, batch_events=batching)
+
+        text_channel.post(members[0], "among:setup")
+        await gateway.drain()
+        await settle(client)
+        session = client.presences.by_text_channel(text_channel.id)
+        session.mute_delay = 0
+        session.control_panel.click_window = 0
+        gateway.api.calls.clear()
+        gateway.events.clear()
+
+        def reconciled():
+            for tracked_member in session.roster:
+                member = tracked_member.member
+                if tracked_member.state == MemberState.IGNORED or not member.voice or member.voice.channel is not voice_channel:
+                    continue
+                if member.voice.mute != (tracked_member.state == MemberState.DEAD or session.muting):
+                    return False
+            return True
+
+        handling = 0
+        monitor = LoopLagMonitor()
+        monitor.start()
+        start = time.perf_counter()
+        for burst in range(bursts):
+            burst_start = time.perf_counter()
+            for n in range(burst_size):
+                kind = n % 3
+                if kind == 0:
+                    session.control_panel.message.click("🔈", members[n % players])
+                elif kind == 1:
+                    text_channel.post(members[0], str(1 + n % players))
+                else:
+                    hopper = hoppers[n % extras]
+                    hopper.join(lobby if hopper.voice.channel is voice_channel else voice_channel)
+            await gateway.drain()
+            handling += time.perf_counter() - burst_start
+            await asyncio.sleep(0.2)  # time between bursts
+        await gateway.drain()
+        await guild.wait_until(reconciled)
+        await settle(client)
+        elapsed = time.perf_counter() - start
+        monitor.stop()
+        actor = session.presence.actor
+        await client.close()
+    events = sum(gateway.events.values())
+    return {"storm": elapsed, "events": events, "events_per_second": events / handling, "batches": actor.batches,
+            "loop_lags": monitor.lags, "api": gateway.api}
+
+
+async def scenario_mimic(latency, players=10, gestures=10, hold=0.3, speculative=False):
+    """A mimic toggling mute with the deafen gesture once per round, holding the deafen for `hold` seconds each time."""
+    with tempfile.TemporaryDirectory() as path:
+        gateway = FakeGateway(FakeAPI(latency=latency, buckets=BUCKETS))
+        store = GuildStore(path)
+        guild, text_channel, voice_channel, members = setup_guild(gateway, store, players=players, configured=False)
+        client = await start_client(gateway, store, speculative_mimic=speculative)
+
+        text_channel.post(members[0], "among:setup")
+        await gateway.drain()
+        await settle(client)
+        session = client.presences.by_text_channel(text_channel.id)
+        session.mute_delay = 0
+        mimic = members[0]
+        session.control_panel.message.click("©", mimic)
+        await gateway.drain()
+
+        from_deafen, from_undeafen = [], []
+        monitor = LoopLagMonitor()
+        monitor.start()
+        for gesture in range(gestures):
+            muting = not session.muting
+
+            async def everyone_done():
+                await guild.wait_until(lambda: all(member.voice.mute == muting for member in members))
+                return time.perf_counter()
+            done = asyncio.create_task(everyone_done())
+            start = time.perf_counter()
+            mimic.deafen()
+            await asyncio.sleep(hold)
+            undeafened = time.perf_counter()
+            mimic.deafen(False)
+            end = await done
+            from_deafen.append(end - start)
+            from_undeafen.append(max(0.0, end - undeafened))
+            await gateway.drain()
+            await asyncio.sleep(BUCKETS["member.edit"][1])  # rounds last longer than a rate limit window
+        await settle(client)
+        monitor.stop()
+        await client.close()
+    return {"from_deafen": from_deafen, "from_undeafen": from_undeafen, "loop_lags": monitor.lags, "api": gateway.api}
+
+
+async def scenario_reconnect(latency, players=15, reconnects=5, drifted=3, low_memory=False):
+    """Gateway reconnects that lose some voice state events on the way, with muting on."""
+    with tempfile.TemporaryDirectory() as path:
+        gateway = FakeGateway(FakeAPI(latency=latency, buckets=BUCKETS))
+        store = GuildStore(path)
+        guild, text_channel, voice_channel, members = setup_guild(gateway, store, players=players, configured=False)
+        client = await start_client(gateway, store, low_memory=low_memory)
+
+        text_channel.post(members[0], "among:setup")
+        await gateway.drain()
+        session = client.presences.by_text_channel(text_channel.id)
+        session.mute_delay = 0
+        session.control_panel.message.click("🔈", members[0])
+        await guild.wait_until(lambda: all(member.voice.mute for member in members))
+        await gateway.drain()
+        await settle(client)
+        gateway.api.calls.clear()
+        gateway.events.clear()
+
+        latecomers = []
+        start = time.perf_counter()
+        for reconnect in range(reconnects):
+            for member in members[reconnect:reconnect + drifted]:
+                member.drift(mute=False)  # someone unmuted them and we missed it
+            latecomer = guild.add_member(f"latecomer{reconnect}")
+            latecomer.drift(channel=voice_channel, mute=True)  # joined while we were away
+            latecomers.append(latecomer)
+            await client.reconnect()
+            await guild.wait_until(lambda: all(member.voice.mute for member in members))
+            await gateway.drain()
+        await settle(client)
+        elapsed = time.perf_counter() - start
+        result = {"reconnects": elapsed, "presences": len(client.presences), "tracked": len(session.roster), "api": gateway.api}
+        await client.close()
+    return result
+
+
+async def scenario_restart_midgame(latency, players=15, dead=3, snapshots=True):
+    """The bot restarting in the middle of a game with muting on, while a muted member is out of voice."""
+    with tempfile.TemporaryDirectory() as path:
+        gateway = FakeGateway(FakeAPI(latency=latency, buckets=BUCKETS))
+        guild, text_channel, voice_channel, members = setup_guild(gateway, GuildStore(path), players=players, configured=False)
+        lobby = guild.add_voice_channel("Lobby")
+        client = await start_client(gateway, GuildStore(path), snapshot_max_age=600 if snapshots else 0)
+
+        text_channel.post(members[0], "among:setup")
+        await gateway.drain()
+        session = client.presences.by_text_channel(text_channel.id)
+        for member in members[1:1 + dead]:
+            session.roster.set_state(session.roster.get(member.id), MemberState.DEAD)
+        session.control_panel.message.click("🔈", members[0])
+        await guild.wait_until(lambda: all(member.voice.mute for member in members))
+        await gateway.drain()
+        slots = {tracked_member.id: tracked_member.slot for tracked_member in session.roster}
+        leaver, drifted = members[-1], members[-2]
+        leaver.leave()  # still muted
+        await gateway.drain()
+        await settle(client)
+        await client.close()
+
+        drifted.drift(mute=False)  # someone unmuted them while the bot was down
+        gateway.api.calls.clear()
+        start = time.perf_counter()
+        client = await start_client(gateway, GuildStore(path), snapshot_max_age=600 if snapshots else 0)
+        session = client.presences.by_text_channel(text_channel.id)
+        if snapshots:
+            await guild.wait_until(lambda: drifted.voice.mute)
+        await gateway.drain()
+        await settle(client)
+        elapsed = time.perf_counter() - start
+        result = {
+            "restart": elapsed,
+            "restart_member_edits": gateway.api.calls["member.edit"],
+            "muting_restored": session.muting,
+            "dead_restored": session.roster.count(MemberState.DEAD),
+            "slots_kept": sum(slots.get(tracked_member.id) == tracked_member.slot for tracked_member in session.roster),
+            "still_muted": sum(bool(member.voice and member.voice.mute) for member in members),
+        }
+
+        gateway.api.calls.clear()
+        leaver.join(lobby)  # back in voice, in a channel no session tracks
+        await guild.wait_until(lambda: not leaver.voice.mute)
+        await gateway.drain()
+        result["returned_member_edits"] = gateway.api.calls["member.edit"]
+        result["api"] = gateway.api
+        await client.close()
+    return result
+
+
+SCENARIOS = {
+    "restart": scenario_restart,
+    "restart-midgame": scenario_restart_midgame,
+    "restart-midgame-no-snapshot": functools.partial(scenario_restart_midgame, snapshots=False),
+    "reconnect": scenario_reconnect,
+    "reconnect-low-memory": functools.partial(scenario_reconnect, low_memory=True),
+    "meeting": scenario_meeting,
+    "meeting-cues": functools.partial(scenario_meeting, cues=True),
+    "slow-echo": scenario_slow_echo,
+    "mimic": scenario_mimic,
+    "mimic-speculative": functools.partial(scenario_mimic, speculative=True),
+    "churn": scenario_churn,
+    "churn-low-memory": functools.partial(scenario_churn, low_memory=True),
+    "spam": scenario_spam,
+    "storm": scenario_storm,
+    "storm-unbatched": functools.partial(scenario_storm, batching=False),
+}
+
+
+def summarize(result):
+    api = result.pop("api")
+    summary = {name: value for name, value in result.items() if not isinstance(value, list)}
+    summary["api_calls"] = dict(api.calls)
+    summary["rate_limited"] = dict(api.rate_limited)
+    for name in ("toggle_latencies", "from_deafen", "from_undeafen", "loop_lags"):
+        values = result.get(name)
+        if values:
+            summary[name] = {"p50": percentile(values, 50), "p99": percentile(values, 99), "max": max(values), "mean": statistics.mean(values)}
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("scenarios", nargs="*", metavar="scenario", help=f"any of {', '.join(SCENARIOS)}, all of them by default")
+    parser.add_argument("--latency", type=float, default=0.05, help="simulated REST latency in seconds")
+    parser.add_argument("--json", action="store_true", help="print machine readable results")
+    args = parser.parse_args()
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            parser.error(f"unknown scenario {name}")
+    args.scenarios = args.scenarios or list(SCENARIOS)
+
+    results = {name: summarize(asyncio.run(SCENARIOS[name](args.latency))) for name in args.scenarios}
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for name, summary in results.items():
+        print(f"== {name}")
+        for key, value in summary.items():
+            if isinstance(value, dict) and value and all(isinstance(v, float) for v in value.values()):
+                value = ", ".join(f"{k} {v * 1000:.1f}ms" for k, v in value.items())
+            elif isinstance(value, float) and key.endswith("_per_second"):
+                value = f"{value:.0f}/s"
+            elif isinstance(value, float):
+                value = f"{value:.2f}s"
+            print(f"  {key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""Runs the offline bot as several shard processes under a Coordinator, all sharing one guild store.
+
+Every process builds the same offline guilds and only connects to the ones on its shards, sets them all up and toggles
+mute a few times. Checks that every guild's settings end up in the store, that the merged metrics add up to what all
+the processes did, that a shard can't be claimed twice, and that a killed process gets restarted and picks its guilds
+back up from the store.
+Run from the repository root with `python3 -m benchmarks.shards [processes...]`.
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import tempfile
+import time
+
+from amongbot.errors import StoreLockedError
+from amongbot.metrics import metrics
+from amongbot.offline import FakeAPI, FakeGateway, OfflineClient
+from amongbot.shards import Coordinator, ShardReporter, open_store, run_until_terminated
+
+from .replay import BUCKETS, MUTE_RATE, setup_guild
+
+GUILDS = 64
+PLAYERS = 5
+SHARDS = 8
+TOGGLES = 5
+
+
+def offline_shard_group(index, shard_ids, shard_count, connection, store_path):
+    """Process target, the offline counterpart of amongbot.shards.run_shard_group."""
+    asyncio.run(_offline_shard_group(index, shard_ids, shard_count, connection, store_path))
+
+
+async def _offline_shard_group(index, shard_ids, shard_count, connection, store_path):
+    metrics.enabled = True
+    try:
+        store = open_store(store_path, shard_ids, shard_count)
+    except StoreLockedError as error:
+        print(f"Shard process {index} can't start yet: {error}")
+        return
+    gateway = FakeGateway(FakeAPI(latency=0.005, buckets=BUCKETS), shard_ids=shard_ids, shard_count=shard_count)
+    lobbies = [setup_guild(gateway, store, players=PLAYERS, configured=False) for _ in range(GUILDS)]
+    lobbies = [lobby for lobby in lobbies if lobby[0] in gateway.guilds]
+    client = OfflineClient(gateway, store=store, mute_rate=MUTE_RATE, reconcile_interval=None)
+    reporter = ShardReporter(client, connection, index=index, shard_ids=shard_ids, interval=0.2)
+    reporter.start()
+
+    async def play():
+        await client.start()
+        await gateway.drain()
+        # a restarted process finds its sessions in the store, only their panels are gone with the old offline guilds
+        metrics.set("sessions_loaded", sum(len(presence.sessions) for presence in client.presences), str(index))
+        start = time.perf_counter()
+        for guild, text_channel, voice_channel, members in lobbies:
+            session = client.presences.by_text_channel(text_channel.id)
+            if session is None:
+                text_channel.post(members[0], "among:setup")
+            elif session.control_panel.message is None:
+                session.presence.actor.post("panel", session.control_panel.send_new)
+        await gateway.drain()
+
+        for toggle in range(TOGGLES):
+            muting = toggle % 2 == 0
+            for guild, text_channel, voice_channel, members in lobbies:
+                session = client.presences.by_text_channel(text_channel.id)
+                session.mute_delay = 0
+                session.control_panel.message.click("🔈", members[toggle % PLAYERS])  # a different member every time, or the clicks collapse
+            for guild, text_channel, voice_channel, members in lobbies:
+                await guild.wait_until(lambda: all(member.voice.mute == muting for member in members))
+            await gateway.drain()
+        metrics.observe("scenario_seconds", time.perf_counter() - start)
+        await store.flush()
+        metrics.count("scenarios_done")
+        await asyncio.Event().wait()  # like a real shard process, run until the coordinator terminates it
+
+    await run_until_terminated(client, play())
+
+
+async def wait_for(predicate, timeout=60):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise TimeoutError
+        await asyncio.sleep(0.05)
+
+
+async def bench(processes):
+    with tempfile.TemporaryDirectory() as path:
+        coordinator = Coordinator(offline_shard_group, shard_count=SHARDS, processes=processes, args=(path,), restart_delay=0.5)
+        counters = coordinator.metrics.counters
+        runner = asyncio.create_task(coordinator.run())
+        start = time.perf_counter()
+        await wait_for(lambda: counters.get(("scenarios_done", "", None)) == processes)
+        elapsed = time.perf_counter() - start
+        result = {
+            "elapsed": elapsed,
+            "slowest_process": coordinator.metrics.histograms[("scenario_seconds", "", None)].max,
+            "guilds": sum(shard_process.health["guilds"] for shard_process in coordinator.processes),
+            "member_edits": counters[("api_calls", "member.edit", None)],
+            "expected_member_edits": GUILDS * PLAYERS * TOGGLES,
+        }
+
+        saved = [name for name in os.listdir(path) if name.endswith(".json")]
+        result["guilds_saved"] = len(saved)
+        result["sessions_saved"] = 0
+        for name in saved:
+            with open(os.path.join(path, name)) as save_file:
+                result["sessions_saved"] += len(json.load(save_file)["sessions"])
+        result["temp_files"] = len([name for name in os.listdir(path) if name.endswith(".tmp")])
+
+        try:
+            open_store(path, coordinator.processes[0].shard_ids, SHARDS)
+            result["double_claim"] = "allowed"
+        except StoreLockedError:
+            result["double_claim"] = "refused"
+
+        # kill a process without letting it clean up, and wait for its replacement to get through the scenario again
+        victim = coordinator.processes[-1]
+        old_pid = victim.process.pid
+        os.kill(old_pid, signal.SIGKILL)
+        killed = time.perf_counter()
+        await wait_for(lambda: victim.health and victim.health["pid"] != old_pid and victim.metrics
+                       and victim.metrics["counters"].get(("scenarios_done", "", None)) == 1)
+        result["restart_and_replay"] = time.perf_counter() - killed
+        result["restarts"] = victim.restarts
+        result["sessions_reloaded"] = coordinator.metrics.gauges[("sessions_loaded", str(victim.index), None)]
+        result["victim_guilds"] = victim.health["guilds"]
+
+        coordinator.stop()
+        await runner
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("processes", nargs="*", type=int, help="process counts to try, 1 2 4 by default")
+    parser.add_argument("--json", action="store_true", help="print machine readable results")
+    args = parser.parse_args()
+    results = {processes: asyncio.run(bench(processes)) for processes in args.processes or (1, 2, 4)}
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{GUILDS} guilds with {PLAYERS} players on {SHARDS} shards, {TOGGLES} toggles in every guild, on {os.cpu_count()} cores")
+    for processes, result in results.items():
+        print(f"== {processes} processes")
+        for key, value in result.items():
+            print(f"  {key}: {f'{value:.2f}s' if isinstance(value, float) else value}")
+
+
+if __name__ == "__main__":
+    main()